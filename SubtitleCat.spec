@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('logo.png', '.'), ('api_keys.json', '.')],
-    hiddenimports=['google.generativeai', 'pysrt'],
+    hiddenimports=['google.generativeai'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
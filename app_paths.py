@@ -0,0 +1,16 @@
+import os
+import sys
+
+
+def app_dir():
+    """
+    程序所在目录，用于放置需要跨次运行保留的文件（翻译记忆、ffprobe 缓存、术语表）。
+    PyInstaller 单文件 EXE 中 __file__ 位于退出时会被删除的临时解压目录，此时改用 EXE 所在目录。
+    """
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(os.path.abspath(sys.executable))
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def data_path(name):
+    return os.path.join(app_dir(), name)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+离线基准测试：启动本地 Gemini 替身服务（mock_gemini.py），用假 key 对样例字幕跑完整的 translate_files，
+报告每秒翻译行数、每行请求数和批次延迟 p50/p99，并逐行校验输出是否完整、对齐。
+    python benchmark.py                                   # 默认 ko/ 目录
+    python benchmark.py ko --backend async -c 16 --latency 0.5 --rate-429 0.05 --drop-rate 0.02
+    python benchmark.py --memory --json bench.json        # 冷/热两轮，对比翻译记忆的效果
+源文件会复制到临时目录再翻译，不会在样例目录里留下输出或续传日志。
+"""
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+import translate
+from cli import collect_srt_files
+from mock_gemini import add_mock_arguments, mock_from_args, fake_translation
+
+
+class TimedEngine:
+    """包装翻译后端，记录每次 generate 的耗时（含重试和等待 key 的时间），即一个批次的端到端延迟。"""
+    def __init__(self, engine):
+        self.engine = engine
+        self.concurrency = engine.concurrency
+        self.latencies = []
+
+    async def generate(self, prompt, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self.engine.generate(prompt, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    async def aclose(self):
+        await self.engine.aclose()
+
+
+def percentile(values, pct):
+    """最近秩百分位数，values 为空时返回 0。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def verify_ass(srt_file, ass_file):
+    """返回 (应有行数, 缺失行数, 译文不对应的行数)。"""
+    expected = len(translate.load_cues(srt_file)[2])
+    written = wrong = 0
+    if os.path.exists(ass_file):
+        with open(ass_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.startswith("Dialogue:"):
+                    continue
+                written += 1
+                orig, _, trans = line.rstrip("\n").split(",", 9)[9].partition("\\N{rEng}")
+                if trans != fake_translation(orig):
+                    wrong += 1
+    return expected, expected - written, wrong
+
+
+def run_once(srt_files, args, mock, api_keys, label):
+    workdir = tempfile.mkdtemp(prefix="subtitlecat-bench-")
+    try:
+        copies = []
+        for i, src in enumerate(srt_files):
+            dst = os.path.join(workdir, f"{i:04d}_{os.path.basename(src)}")
+            shutil.copyfile(src, dst)
+            copies.append(dst)
+
+        log_lines = []
+        log = print if args.verbose else log_lines.append
+        pool = translate.get_key_pool(api_keys)
+        engine = TimedEngine(translate.make_engine(args.backend, max_workers=args.workers, pool=pool))
+        before = mock.snapshot()
+        start = time.perf_counter()
+        try:
+            summary = translate.translate_files(copies, args.lang, log=log, engine=engine, concurrency=args.concurrency,
+                                      use_memory=args.memory, dedup=not args.no_dedup, json_mode=args.json_mode,
+                                      formats=["ass"], glossary=args.glossary_terms, show_context=args.show_context,
+                                      context_cache=not args.no_context_cache)
+        finally:
+            elapsed = time.perf_counter() - start
+            # translate_files 不关闭外部传入的后端；异步客户端绑定在已结束的事件循环上，随之丢弃即可
+            if args.backend == "thread":
+                asyncio.run(engine.aclose())
+        after = mock.snapshot()
+
+        cues = missing = wrong = 0
+        for copy in copies:
+            expected, file_missing, file_wrong = verify_ass(copy, os.path.splitext(copy)[0] + ".Dex7er.EN.CN.ass")
+            cues += expected
+            missing += file_missing
+            wrong += file_wrong
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    server = {k: after[k] - before[k] for k in after}
+    result = {
+        "run": label,
+        "files": len(srt_files),
+        "cues": cues,
+        "seconds": round(elapsed, 3),
+        "cues_per_sec": round(cues / elapsed, 1) if elapsed else 0.0,
+        "requests": server["requests"],
+        "requests_per_cue": round(server["requests"] / cues, 4) if cues else 0.0,
+        "batches": len(engine.latencies),
+        "latency_p50_ms": round(percentile(engine.latencies, 50) * 1000, 1),
+        "latency_p99_ms": round(percentile(engine.latencies, 99) * 1000, 1),
+        "errors_429": server["429"],
+        "errors_503": server["503"],
+        "dropped": server["dropped"],
+        "garbled": server["garbled"],
+        "prompt_tokens": server["prompt_tokens"],
+        "cached_tokens": server["cached_tokens"],
+        "output_tokens": server["output_tokens"],
+        "missing": missing,
+        "misaligned": wrong,
+        "metrics": summary,
+    }
+    print(f"[{label}] {result['files']} 个文件 {cues} 行，耗时 {result['seconds']}s，"
+          f"{result['cues_per_sec']} 行/s")
+    print(f"[{label}] 请求 {result['requests']} 个（{result['requests_per_cue']} 请求/行，429 {result['errors_429']} 次，"
+          f"503 {result['errors_503']} 次），输入 {result['prompt_tokens']}（缓存 {result['cached_tokens']}）"
+          f" / 输出 {result['output_tokens']} token")
+    print(f"[{label}] 批次延迟 p50 {result['latency_p50_ms']}ms，p99 {result['latency_p99_ms']}ms（共 {result['batches']} 次调用）")
+    print(f"[{label}] 校验：缺失 {missing} 行，译文错位 {wrong} 行")
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="用本地 Gemini 替身服务对 translate_files 做离线基准测试")
+    parser.add_argument("inputs", nargs="*", default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), "ko")],
+                        help="SRT 文件、目录或通配符（默认样例目录 ko/）")
+    parser.add_argument("-l", "--lang", default="zh", choices=sorted(translate.LANG_MAP), help="目标语言（默认 zh）")
+    parser.add_argument("-c", "--concurrency", type=int, help="同时在途的批次数（默认按后端和 key 数决定）")
+    parser.add_argument("--backend", default=translate.BACKEND, choices=["thread", "async"], help="翻译后端")
+    parser.add_argument("--workers", type=int, default=translate.MAX_WORKERS, help="thread 后端的线程数")
+    parser.add_argument("--keys", type=int, default=4, help="假 API key 的数量")
+    parser.add_argument("--key-rpm", type=int, default=0, help="客户端每个 key 的 RPM 限制（默认 0，不限）")
+    parser.add_argument("--key-tpm", type=int, default=0, help="客户端每个 key 的 TPM 限制（默认 0，不限）")
+    parser.add_argument("--runs", type=int, default=1, help="重复运行的次数")
+    parser.add_argument("--memory", action="store_true", help="使用临时翻译记忆：先跑一轮冷运行，再跑 --runs 轮命中缓存的热运行")
+    parser.add_argument("--no-dedup", action="store_true", help="不合并重复行")
+    parser.add_argument("--json-mode", action="store_true", help="使用结构化 JSON 输出")
+    parser.add_argument("--glossary", help="术语表文件（JSON 对象），加入固定提示词")
+    parser.add_argument("--show-context", help="剧情背景说明，加入固定提示词")
+    parser.add_argument("--no-context-cache", action="store_true", help="不创建上下文缓存")
+    parser.add_argument("--json", help="把结果写入该 JSON 文件")
+    parser.add_argument("-v", "--verbose", action="store_true", help="打印翻译日志")
+    add_mock_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    srt_files = collect_srt_files(args.inputs)
+    if not srt_files:
+        print("没有找到 SRT 文件", file=sys.stderr)
+        return 1
+
+    # 基准只测本地流水线：限速由替身服务模拟，客户端的 key 池按参数设置
+    translate.KEY_RPM = args.key_rpm
+    translate.KEY_TPM = args.key_tpm
+    # 客户端与替身服务使用相同的上下文缓存最小 token 数；术语表只用显式指定的文件
+    translate.CACHE_MIN_TOKENS = args.cache_min_tokens
+    args.glossary_terms = translate.load_glossary(args.glossary) if args.glossary else {}
+    api_keys = [f"bench-key-{i}" for i in range(1, max(1, args.keys) + 1)]
+    tm_dir = tempfile.mkdtemp(prefix="subtitlecat-tm-") if args.memory else None
+    if tm_dir:
+        translate.TM_FILE = os.path.join(tm_dir, "translation_memory.db")
+
+    results = []
+    with mock_from_args(args) as mock:
+        translate.BASE_URL = mock.base_url
+        try:
+            # 使用翻译记忆时先跑一轮空缓存的冷运行，之后的每一轮都是命中缓存的热运行
+            labels = [f"run {i}" for i in range(1, args.runs + 1)]
+            if args.memory:
+                labels = ["cold"] + [f"warm {i}" if args.runs > 1 else "warm" for i in range(1, args.runs + 1)]
+            for label in labels:
+                results.append(run_once(srt_files, args, mock, api_keys, label))
+        finally:
+            memory = translate.get_translation_memory() if tm_dir else None
+            if memory:
+                memory.close()
+            if tm_dir:
+                shutil.rmtree(tm_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    return 0 if all(r["missing"] == 0 and r["misaligned"] == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
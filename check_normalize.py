@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+核对 normalize.py 的清洗结果与原来逐条 re.sub 的规则完全一致：用内置样例和给定的 SRT 文件对比两套实现。
+    python check_normalize.py ko/Korean.kor.srt
+"""
+import re
+import sys
+import unicodedata
+
+from normalize import normalize_texts
+
+
+def clean_subtitle_text_reference(text):
+    """translate.py 原来的逐条清洗规则。"""
+    text = re.sub(r'\[.*?\]', '', text)
+    text = re.sub(r'^[A-Za-z][A-Za-z\s]*:', '', text)
+    text = re.sub(r'<font[^>]*>', '', text).replace('</font>', '')
+    text = re.sub(r'<i>(?:(?![a-zA-Z0-9]).)*?</i>', '', text)
+    text = re.sub(r'\n', ' ', text)
+    text = re.sub(r'--', '...', text)
+    text = re.sub(r'-\s+', '- ', text)
+    text = re.sub(r' -\s+', ' - ', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def has_language_text_reference(text):
+    cleaned = ''.join(c for c in text if not unicodedata.category(c).startswith('P') and not c.isspace())
+    return bool(cleaned)
+
+
+# 覆盖各条规则边界情况的样例
+SAMPLE_CORPUS = [
+    "",
+    "   ",
+    "...",
+    "♪",
+    "♪ la la ♪",
+    "[music playing]",
+    "[door\nslams] Hello",
+    "[a] b [c]",
+    "JOHN: Hello there",
+    "JOHN\nSMITH: Hello",
+    "Mr. Smith: hi",
+    "1: not a speaker",
+    "Time: 10:30",
+    "<font color=\"#ffffff\">White</font> text",
+    "</<font>font> nested",
+    "<i>♪</i> song",
+    "<i>Italic words</i>",
+    "<i>- </i>Hey",
+    "<i>...\n</i>",
+    "Wait--what?",
+    "---",
+    "- Yes.\n- No.",
+    "-   spaced  -   dash",
+    "a -\n\tb",
+    "tabs\tand　ideographic spaces",
+    " non-breaking ",
+    "거, 오늘은 운전 살살 좀 해",
+    "「こんにちは」",
+    "¿Qué?",
+    "$100 + 5 = ~",
+    "​",
+    "'\"!?",
+]
+
+
+def verify(texts):
+    """返回与原始规则不一致的 (原文, 新结果, 原结果) 列表。"""
+    mismatches = []
+    for text in texts:
+        got = normalize_texts([text])[0]
+        ref = clean_subtitle_text_reference(text)
+        ref = ref if ref and has_language_text_reference(ref) else None
+        if got != ref:
+            mismatches.append((text, got, ref))
+    return mismatches
+
+
+if __name__ == "__main__":
+    from srt_reader import iter_cues
+
+    corpus = list(SAMPLE_CORPUS)
+    for path in sys.argv[1:]:
+        corpus.extend(cue.text for cue in iter_cues(path))
+    bad = verify(corpus)
+    for text, got, ref in bad[:20]:
+        print(f"不一致: {text!r}\n  新: {got!r}\n  原: {ref!r}")
+    print(f"共核对 {len(corpus)} 条，不一致 {len(bad)} 条")
+    sys.exit(1 if bad else 0)
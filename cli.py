@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+命令行入口，不依赖 Tkinter，可在无显示器的渲染节点、cron 或入库流程中使用：
+    python cli.py D:/shows/S01 -l zh -f ass,vtt
+    python cli.py "ko/**/*.srt" --dry-run
+API key 依次取自 --api-key、环境变量 GEMINI_API_KEYS（逗号分隔）、--keys-file，最后是 api_keys.json。
+"""
+import os
+import sys
+import glob
+import json
+import signal
+import argparse
+import threading
+
+import metrics
+import translate
+from subtitle_writers import OUTPUT_FORMATS, is_output_file
+
+
+def collect_srt_files(inputs):
+    """把目录（递归）、通配符和文件路径展开成去重、排序后的 SRT 列表，跳过本工具生成的字幕。"""
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                found.extend(os.path.join(root, f) for f in files if f.lower().endswith(".srt"))
+        elif glob.has_magic(item):
+            found.extend(glob.glob(item, recursive=True))
+        else:
+            found.append(item)
+    files = {os.path.abspath(f) for f in found if f.lower().endswith(".srt") and not is_output_file(f)}
+    return sorted(files)
+
+
+def resolve_api_keys(args):
+    if args.api_key:
+        return args.api_key
+    env = os.environ.get("GEMINI_API_KEYS", "")
+    if env.strip():
+        return [k for k in env.split(",") if k.strip()]
+    return translate.load_api_keys(args.keys_file)
+
+
+def read_show_context(value):
+    """--show-context 的值以 @ 开头时读取对应文件。"""
+    if value and value.startswith("@"):
+        with open(value[1:], "r", encoding="utf-8") as f:
+            return f.read()
+    return value
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="用 Gemini 批量翻译 SRT 字幕")
+    parser.add_argument("inputs", nargs="+", help="SRT 文件、目录（递归扫描）或通配符")
+    parser.add_argument("-l", "--lang", default="zh", choices=sorted(translate.LANG_MAP), help="目标语言（默认 zh）")
+    parser.add_argument("-f", "--formats", default=",".join(translate.FORMATS),
+                        help=f"输出格式，逗号分隔（可选: {', '.join(OUTPUT_FORMATS)}）")
+    parser.add_argument("-c", "--concurrency", type=int, help="同时在途的批次数（默认按后端和 key 数决定）")
+    parser.add_argument("--backend", default=translate.BACKEND, choices=["thread", "async"], help="翻译后端")
+    parser.add_argument("--workers", type=int, default=translate.MAX_WORKERS, help="thread 后端的线程数")
+    parser.add_argument("--model", default=translate.MODEL, help=f"Gemini 模型（默认 {translate.MODEL}）")
+    parser.add_argument("--base-url", default=translate.BASE_URL,
+                        help="Gemini API 地址，默认为官方地址；可指向本地 mock_gemini.py 离线测试")
+    parser.add_argument("--api-key", action="append", help="API key，可重复指定")
+    parser.add_argument("--keys-file", help="API key 文件（JSON 数组），默认为程序目录下的 api_keys.json")
+    parser.add_argument("--key-rpm", type=int, default=translate.KEY_RPM,
+                        help="每个 key 每分钟的请求数上限，0 表示不在客户端限速（免费层为 10）")
+    parser.add_argument("--key-tpm", type=int, default=translate.KEY_TPM,
+                        help="每个 key 每分钟的输入 token 上限，0 表示不限（免费层为 250000）")
+    parser.add_argument("--key-rpd", type=int, default=translate.KEY_RPD,
+                        help="每个 key 每天的请求数上限，只用于 dry-run 估算天数（免费层为 250）")
+    parser.add_argument("--no-memory", action="store_true", help="不使用翻译记忆")
+    parser.add_argument("--no-dedup", action="store_true", help="不合并重复行")
+    parser.add_argument("--json-mode", action="store_true", help="要求 Gemini 返回结构化 JSON")
+    parser.add_argument("--glossary", help="术语表文件（JSON 对象，{\"原文\": \"译名\"}），默认为程序目录下的 glossary.json（如存在）")
+    parser.add_argument("--show-context", help="剧情背景说明（人物、称呼、语气等），或以 @ 开头的文本文件路径")
+    parser.add_argument("--no-context-cache", action="store_true", help="不创建上下文缓存，每个请求都附带固定提示词")
+    parser.add_argument("--dry-run", action="store_true", help="只估算待翻译的行数、请求数、token 数和耗时，不调用 API、不写文件")
+    parser.add_argument("--metrics-json", help="把本次运行的统计（各阶段耗时、请求、重试、token、缓存命中率）写入该 JSON 文件；dry-run 时写入估算结果")
+    parser.add_argument("--prometheus", default=metrics.PROMETHEUS_FILE,
+                        help="运行中定期把累计指标以 Prometheus 文本格式写入该文件（textfile collector）")
+    args = parser.parse_args(argv)
+
+    args.formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    unknown = [f for f in args.formats if f not in OUTPUT_FORMATS]
+    if unknown or not args.formats:
+        parser.error(f"不支持的输出格式: {', '.join(unknown) or '（空）'}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # 模型名会写入翻译记忆和续传日志的键，换模型不会复用旧译文
+    translate.MODEL = args.model
+    translate.BASE_URL = args.base_url
+    translate.KEY_RPM = args.key_rpm
+    translate.KEY_TPM = args.key_tpm
+    translate.KEY_RPD = args.key_rpd
+    metrics.PROMETHEUS_FILE = args.prometheus
+
+    srt_files = collect_srt_files(args.inputs)
+    if not srt_files:
+        print("没有找到 SRT 文件", file=sys.stderr)
+        return 1
+    try:
+        glossary = translate.load_glossary(args.glossary)
+        show_context = read_show_context(args.show_context)
+    except Exception as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    prompt_options = dict(json_mode=args.json_mode, glossary=glossary, show_context=show_context,
+                          context_cache=not args.no_context_cache)
+
+    if args.dry_run:
+        try:
+            api_keys = resolve_api_keys(args)
+        except Exception:
+            # 只用于按 key 数估算耗时，没有 key 文件也能 dry-run
+            api_keys = None
+        plan = translate.plan_translation(srt_files, args.lang, use_memory=not args.no_memory, dedup=not args.no_dedup,
+                                          formats=args.formats, api_keys=api_keys, **prompt_options)
+        if args.metrics_json:
+            with open(args.metrics_json, "w", encoding="utf-8") as f:
+                json.dump(plan, f, ensure_ascii=False, indent=2)
+        return 0
+
+    try:
+        api_keys = resolve_api_keys(args)
+    except Exception as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    # 第一次 Ctrl+C 让进行中的批次收尾并保存续传进度，第二次直接退出
+    stop = threading.Event()
+
+    def on_sigint(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        stop.set()
+        print("⚠️ 正在停止，再按一次 Ctrl+C 强制退出", file=sys.stderr)
+
+    signal.signal(signal.SIGINT, on_sigint)
+    try:
+        summary = translate.translate_files(
+            srt_files, args.lang, stop_flag=stop.is_set, max_workers=args.workers, backend=args.backend,
+            concurrency=args.concurrency, use_memory=not args.no_memory, dedup=not args.no_dedup,
+            formats=args.formats, api_keys=api_keys, **prompt_options,
+        )
+    except KeyboardInterrupt:
+        return 130
+    except Exception as e:
+        print(f"❌ 翻译过程中发生错误: {e}", file=sys.stderr)
+        return 1
+    if args.metrics_json:
+        with open(args.metrics_json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return 130 if stop.is_set() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import time
+import asyncio
+import threading
+from google.genai import types
+from metrics import METRICS
+
+
+class PromptContext:
+    """
+    一次运行内所有请求共用的固定提示词（system instruction，含术语表和剧情背景）。
+    use_cache 为 True 时在每个 API key 上懒创建一次显式上下文缓存（cachedContents），之后的请求只引用缓存名，
+    不再重复发送固定提示词；缓存按 key 隔离（缓存属于 key 所在的项目），快到期时自动重建。
+    某个 key 创建失败（内容太短、模型不支持、权限不足等）后不再重试，该 key 的请求直接附带 system instruction。
+    """
+    def __init__(self, model, system_instruction, tokens, json_config=None, use_cache=False, ttl=3600, log=print):
+        self.model = model
+        self.system_instruction = system_instruction
+        self.tokens = tokens
+        self.json_config = json_config or {}
+        self.use_cache = use_cache
+        self.ttl = ttl
+        self.log = log
+        self.lock = threading.Lock()
+        # key -> (缓存名, 到期时间)；缓存名为 None 表示该 key 不使用缓存
+        self.caches = {}
+        self.pending = {}
+
+    def _direct_config(self):
+        return types.GenerateContentConfig(system_instruction=self.system_instruction, **self.json_config)
+
+    def _cached_config(self, name):
+        # 使用缓存时不能再在请求里设置 system instruction
+        return types.GenerateContentConfig(cached_content=name, **self.json_config)
+
+    def _create_config(self):
+        return types.CreateCachedContentConfig(system_instruction=self.system_instruction, ttl=f"{self.ttl}s",
+                                               display_name="subtitlecat")
+
+    def _valid(self, api_key):
+        entry = self.caches.get(api_key)
+        # 留出一分钟余量，避免请求发出时缓存恰好过期
+        return entry is not None and (entry[0] is None or entry[1] - time.monotonic() > 60)
+
+    def _stored(self, api_key, cache, error):
+        if error is not None:
+            METRICS.inc("context_cache", "failed")
+            self.log(f"⚠️ API key {api_key[:4]}... 创建上下文缓存失败，改为直接发送固定提示词: {error}")
+            self.caches[api_key] = (None, 0)
+        else:
+            METRICS.inc("context_cache", "created")
+            self.caches[api_key] = (cache.name, time.monotonic() + self.ttl)
+        return self.caches[api_key][0]
+
+    def config(self, api_key, client):
+        """返回该 key 的请求配置（同步客户端），必要时先创建缓存。"""
+        if not self.use_cache:
+            return self._direct_config()
+        with self.lock:
+            if not self._valid(api_key):
+                cache, error = None, None
+                try:
+                    cache = client.caches.create(model=self.model, config=self._create_config())
+                except Exception as e:
+                    error = e
+                self._stored(api_key, cache, error)
+            name = self.caches[api_key][0]
+        return self._cached_config(name) if name else self._direct_config()
+
+    async def config_async(self, api_key, client):
+        """config 的异步版本，client 为 genai 的 .aio 客户端；同一个 key 的并发请求只创建一次缓存。"""
+        if not self.use_cache:
+            return self._direct_config()
+        if not self._valid(api_key):
+            task = self.pending.get(api_key)
+            if task is None:
+                async def create():
+                    cache, error = None, None
+                    try:
+                        cache = await client.caches.create(model=self.model, config=self._create_config())
+                    except Exception as e:
+                        error = e
+                    with self.lock:
+                        self._stored(api_key, cache, error)
+                task = self.pending[api_key] = asyncio.ensure_future(create())
+                task.add_done_callback(lambda _: self.pending.pop(api_key, None))
+            await asyncio.shield(task)
+        name = self.caches[api_key][0]
+        return self._cached_config(name) if name else self._direct_config()
+
+    def close(self, client_for):
+        """删除本次运行创建的缓存，不必等到 TTL 到期；client_for(key) 返回同步客户端。"""
+        with self.lock:
+            caches, self.caches = self.caches, {}
+        for api_key, (name, _) in caches.items():
+            if not name:
+                continue
+            try:
+                client_for(api_key).caches.delete(name=name)
+            except Exception as e:
+                self.log(f"⚠️ 删除上下文缓存 {name} 失败: {e}")
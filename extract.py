@@ -0,0 +1,249 @@
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from probe_cache import ProbeCache
+from metrics import METRICS
+from app_paths import data_path
+
+FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
+# 同时运行的 ffmpeg 进程数。提取主要受磁盘/网络读取限制，机械盘或 SMB 上不宜设得太大
+EXTRACT_WORKERS = 4
+# 图形字幕（PGS/VobSub 等）无法直接转换成 SRT
+BITMAP_CODECS = {"hdmv_pgs_subtitle", "dvd_subtitle", "dvb_subtitle", "xsub"}
+# ffprobe 结果缓存文件（与翻译记忆放在同一目录），为空表示不缓存
+PROBE_CACHE_FILE = data_path("probe_cache.db")
+
+_probe_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_probe_cache():
+    """进程内共享的 ffprobe 缓存，未配置 PROBE_CACHE_FILE 时返回 None。"""
+    global _probe_cache
+    with _cache_lock:
+        if _probe_cache is None and PROBE_CACHE_FILE:
+            _probe_cache = ProbeCache(PROBE_CACHE_FILE)
+        return _probe_cache
+
+
+def _startupinfo():
+    # Windows 下隐藏 ffmpeg/ffprobe 的控制台窗口，其他平台不需要
+    if not hasattr(subprocess, "STARTUPINFO"):
+        return None
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    startupinfo.wShowWindow = subprocess.SW_HIDE  # 完全隐藏
+    return startupinfo
+
+
+def _last_line(text):
+    lines = [line for line in (text or "").strip().splitlines() if line.strip()]
+    return lines[-1] if lines else ""
+
+
+def _ffprobe_streams(video_path):
+    result = subprocess.run(
+        [FFPROBE, "-v", "error", "-select_streams", "s",
+         "-show_entries", "stream=index,codec_name:stream_tags=language,title",
+         "-of", "default=noprint_wrappers=1", video_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL, text=True, check=True,
+        startupinfo=_startupinfo()
+    )
+    lines = result.stdout.strip().splitlines()
+    subs = []
+    current = {}
+    for line in lines:
+        if line.startswith("index="):
+            if current:
+                subs.append(current)
+            current = {"index": line.split("=")[1]}
+        elif line.startswith("codec_name="):
+            current["codec"] = line.split("=")[1]
+        elif line.startswith("TAG:language="):
+            current["lang"] = line.split("=")[1]
+        elif line.startswith("TAG:title="):
+            current["title"] = line.split("=", 1)[1]
+    if current:
+        subs.append(current)
+    return subs
+
+
+def probe_subtitles(video_path, log=print, use_cache=True):
+    """
+    列出视频中的字幕流，返回 [{"index", "codec", "lang", "title"}, ...]，出错时返回空列表。
+    文件大小和修改时间未变时直接使用缓存，不再启动 ffprobe；探测失败的结果不缓存。
+    """
+    cache = get_probe_cache() if use_cache else None
+    if cache:
+        subs = cache.get(video_path)
+        if subs is not None:
+            METRICS.inc("probe_lookups", "hit")
+            return subs
+        METRICS.inc("probe_lookups", "miss")
+        stat = cache.file_stat(video_path)
+    try:
+        with METRICS.timer("probe"):
+            subs = _ffprobe_streams(video_path)
+    except Exception as e:
+        log(f"⚠️ ffprobe 出错: {e}")
+        return []
+    if cache:
+        cache.put(video_path, subs, stat)
+    return subs
+
+
+def prefetch_probes(video_paths, log=print, stop_flag=None, max_workers=EXTRACT_WORKERS):
+    """
+    在后台为没有缓存的视频预先运行 ffprobe，填充缓存，返回新探测的数量。
+    stop_flag 为真时不再启动新的探测（例如用户换了目录）。
+    """
+    cache = get_probe_cache()
+    if not cache:
+        return 0
+    todo = cache.missing(video_paths)
+    if not todo:
+        return 0
+
+    def probe(video_path):
+        if stop_flag and stop_flag():
+            return False
+        probe_subtitles(video_path, log=log)
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        count = sum(pool.map(probe, todo))
+    log(f"✔ 已在后台读取 {count} 个视频的字幕流信息")
+    return count
+
+
+def srt_paths_for(video_path, streams):
+    """
+    每个字幕流对应的 SRT 路径：<视频名>.<语言>.srt；同一语言有多条流时，
+    后面的流加上流序号（<视频名>.<语言>.<序号>.srt），避免一次调用中多个输出写到同一个文件。
+    """
+    base = os.path.splitext(video_path)[0]
+    paths = []
+    seen = set()
+    for sub in streams:
+        lang = sub.get('lang', 'unknown')
+        paths.append(f"{base}.{lang}.srt" if lang not in seen else f"{base}.{lang}.{sub['index']}.srt")
+        seen.add(lang)
+    return paths
+
+
+def _run_ffmpeg(video_path, outputs, log, label):
+    """一次 ffmpeg 调用导出多条字幕流，outputs 为 [(sub, srt_path), ...]；失败时删除写了一半的文件并抛出异常。"""
+    cmd = [FFMPEG, "-y", "-i", video_path]
+    for sub, srt_path in outputs:
+        cmd += ["-map", f"0:{sub['index']}", "-c:s", "srt", srt_path]
+    log(f"{label}{' '.join(cmd)}")
+    try:
+        with METRICS.timer("extract"):
+            subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.PIPE, text=True, startupinfo=_startupinfo())
+    except (subprocess.CalledProcessError, OSError):
+        # 不留下写了一半的字幕，免得被当成完整文件翻译
+        for _, srt_path in outputs:
+            if os.path.exists(srt_path):
+                os.remove(srt_path)
+        raise
+
+
+def extract_streams(video_path, streams, log=print, stop_flag=None, label=""):
+    """
+    把选中的字幕流导出为 SRT，返回成功写出的文件列表。
+    所有流在一次 ffmpeg 调用中导出（多组 -map/输出），视频文件只读一遍；
+    整体失败时再逐条重试，找出出错的流，其余流照常导出。
+    """
+    name = os.path.basename(video_path)
+    outputs = []
+    for sub, srt_path in zip(streams, srt_paths_for(video_path, streams)):
+        if sub.get("codec") in BITMAP_CODECS:
+            log(f"⚠️ 跳过图形字幕: {name} 流 {sub['index']} ({sub.get('lang', 'unknown')}, {sub['codec']})")
+            continue
+        outputs.append((sub, srt_path))
+    if not outputs or (stop_flag and stop_flag()):
+        return []
+
+    try:
+        _run_ffmpeg(video_path, outputs, log, label)
+        METRICS.inc("extracted_streams", "ok", len(outputs))
+        return [srt_path for _, srt_path in outputs]
+    except (subprocess.CalledProcessError, OSError) as e:
+        if len(outputs) == 1:
+            METRICS.inc("extracted_streams", "failed")
+            detail = _last_line(getattr(e, "stderr", "")) or e
+            log(f"❌ 提取失败: {name} ({outputs[0][0].get('lang', 'unknown')})，错误: {detail}")
+            return []
+        log(f"⚠️ {name} 合并提取失败，改为逐条提取")
+
+    written = []
+    for sub, srt_path in outputs:
+        if stop_flag and stop_flag():
+            break
+        try:
+            _run_ffmpeg(video_path, [(sub, srt_path)], log, label)
+            METRICS.inc("extracted_streams", "ok")
+            written.append(srt_path)
+        except (subprocess.CalledProcessError, OSError) as e:
+            METRICS.inc("extracted_streams", "failed")
+            detail = _last_line(getattr(e, "stderr", "")) or e
+            log(f"❌ 提取失败: {name} ({sub.get('lang', 'unknown')})，错误: {detail}")
+    return written
+
+
+def extract_videos(videos, choose_streams, log=print, stop_flag=None, max_workers=EXTRACT_WORKERS, progress=None):
+    """
+    并行提取一组视频的字幕。
+    先在线程池里并行 ffprobe，再按原顺序在调用线程中调用 choose_streams(video_path, subs)
+    选出要导出的流（可以弹窗询问用户），选好的视频立即交给最多 max_workers 个并行的 ffmpeg 进程。
+    stop_flag 在每个视频开始前检查；progress(done, total, video_path, files) 在每个视频完成后调用，
+    files 为该视频写出的 SRT 列表（跳过或失败时为空）。
+    返回 (成功的视频数, 写出的 SRT 列表)；ffprobe/ffmpeg 的耗时和结果计入 metrics.METRICS。
+    """
+    total = len(videos)
+    done = 0
+    succeeded = 0
+    written = []
+    lock = threading.Lock()
+
+    def finish(video_path, files):
+        nonlocal done, succeeded
+        with lock:
+            done += 1
+            written.extend(files)
+            if files:
+                succeeded += 1
+            current = done
+        if progress:
+            progress(current, total, video_path, files)
+        return current
+
+    def run(idx, video_path, streams):
+        files = []
+        if not (stop_flag and stop_flag()):
+            files = extract_streams(video_path, streams, log=log, stop_flag=stop_flag, label=f"[{idx}/{total}] ")
+        current = finish(video_path, files)
+        log(f"[{current}/{total}] 完成: {os.path.basename(video_path)}，导出 {len(files)} 条字幕")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as probe_pool, \
+            ThreadPoolExecutor(max_workers=max_workers) as extract_pool:
+        probes = [probe_pool.submit(probe_subtitles, v, log) for v in videos]
+        for idx, (video_path, probe) in enumerate(zip(videos, probes), start=1):
+            if stop_flag and stop_flag():
+                log("⚠️ 提取被停止")
+                for p in probes[idx - 1:]:
+                    p.cancel()
+                break
+            subs = probe.result()
+            streams = choose_streams(video_path, subs) if subs else []
+            if not subs:
+                log(f"❌ {os.path.basename(video_path)} 没找到字幕流")
+            if not streams:
+                finish(video_path, [])
+                continue
+            extract_pool.submit(run, idx, video_path, streams)
+    METRICS.export()
+    return succeeded, written
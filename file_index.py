@@ -0,0 +1,113 @@
+import os
+from subtitle_writers import is_output_file
+
+VIDEO_EXTS = (".mp4", ".mkv")
+SUBTITLE_EXTS = (".srt",)
+JOURNAL_EXT = ".journal"
+
+
+def file_kind(name):
+    """
+    返回 "video"、"srt"、"output"（本工具生成的字幕）或 "journal"（输出旁的续传日志），
+    后两种只用于判断翻译状态，不列出；其他文件返回 None。
+    """
+    lower = name.lower()
+    if lower.endswith(VIDEO_EXTS):
+        return "video"
+    if lower.endswith(JOURNAL_EXT) and is_output_file(name[:-len(JOURNAL_EXT)]):
+        return "journal"
+    if is_output_file(name):
+        return "output"
+    if lower.endswith(SUBTITLE_EXTS):
+        return "srt"
+    return None
+
+
+class ScanResult:
+    """一次扫描相对上一次的变化，路径均为相对 root 的路径。reset 为 True 表示这是第一次（或完整）扫描。"""
+    def __init__(self, reset):
+        self.reset = reset
+        self.added = []
+        self.removed = []
+        self.changed = []
+
+    def __bool__(self):
+        return self.reset or bool(self.added or self.removed or self.changed)
+
+
+class FileIndex:
+    """
+    目录下视频和字幕文件的索引：{相对路径: (类型, 大小, 修改时间)}。
+    用 os.scandir 一次遍历同时收集视频和字幕；同时记住每个目录的修改时间和内容，
+    再次扫描时修改时间未变的目录直接沿用上次的结果，只对子目录 stat 一次，
+    新增、删除或改名文件的目录才重新读取。
+    """
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+        # 目录相对路径 -> (目录修改时间, {文件相对路径: 状态}, [子目录相对路径])
+        self.dirs = {}
+
+    def paths(self, kind):
+        return sorted(path for path, state in self.files.items() if state[0] == kind)
+
+    def __contains__(self, path):
+        return path in self.files
+
+    def _read_dir(self, rel, mtime):
+        files, subdirs = {}, []
+        try:
+            with os.scandir(os.path.join(self.root, rel)) as it:
+                for entry in it:
+                    path = os.path.join(rel, entry.name) if rel else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(path)
+                            continue
+                        kind = file_kind(entry.name)
+                        if kind and entry.is_file():
+                            st = entry.stat()
+                            files[path] = (kind, st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        self.dirs[rel] = (mtime, files, subdirs)
+        return files, subdirs
+
+    def scan(self, full=False):
+        """扫描目录并更新索引，返回 ScanResult。full 为 True 时忽略目录缓存，全部重新读取。"""
+        result = ScanResult(reset=full or not self.dirs)
+        if full:
+            self.dirs = {}
+        old_dirs = self.dirs
+        self.dirs = {}
+        files = {}
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            try:
+                mtime = os.stat(os.path.join(self.root, rel)).st_mtime_ns
+            except OSError:
+                continue
+            cached = old_dirs.get(rel)
+            if cached and cached[0] == mtime:
+                # 目录内容没有增删，沿用上次的文件列表
+                self.dirs[rel] = cached
+                dir_files, subdirs = cached[1], cached[2]
+            else:
+                listing = self._read_dir(rel, mtime)
+                if listing is None:
+                    continue
+                dir_files, subdirs = listing
+            files.update(dir_files)
+            stack.extend(subdirs)
+
+        if not result.reset:
+            result.added = sorted(p for p in files if p not in self.files)
+            result.removed = sorted(p for p in self.files if p not in files)
+            result.changed = sorted(p for p, state in files.items() if p in self.files and self.files[p] != state)
+        else:
+            result.added = sorted(files)
+        self.files = files
+        return result
@@ -3,10 +3,207 @@ import json
 import sys
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import subprocess
+import bisect
+import logging
+import logging.handlers
 import threading
 import queue
+from collections import deque
 from PIL import Image, ImageTk
+from extract import EXTRACT_WORKERS, extract_videos, prefetch_probes, probe_subtitles
+from file_index import FileIndex
+from resume_journal import read_progress
+
+# 监视目录时两次增量扫描之间的间隔（毫秒）
+WATCH_INTERVAL = 5000
+# 日志框刷新间隔（毫秒）和最多保留的行数，超出后删除最早的行
+LOG_INTERVAL = 100
+LOG_MAX_LINES = 5000
+# 同时把日志写入滚动文件，为空表示不写；单个文件的大小上限和保留的旧文件个数
+LOG_FILE = ""
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+class FileList:
+    """
+    带勾选、过滤和状态列的文件列表（ttk.Treeview）。
+    Treeview 只绘制可见的行，不再为每个文件创建 Checkbutton 和 BooleanVar；
+    大量文件分批插入，插入期间界面仍可响应。过滤后只有可见且勾选的文件算作选中。
+    """
+    CHECKED = "☑"
+    UNCHECKED = "☐"
+    # 首次载入时每次空闲插入的行数
+    INSERT_CHUNK = 2000
+
+    def __init__(self, parent, title):
+        self.paths = []
+        self.visible = []
+        self.checked = set()
+        self.status = {}
+        self._inserted = set()
+        self._pending = []
+        self._filter_job = None
+        self._filter_text = ""
+
+        top = tk.Frame(parent)
+        top.pack(fill="x")
+        self.select_all_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(top, text="全选", variable=self.select_all_var, command=self.toggle_all).pack(side="left")
+        tk.Label(top, text="过滤:").pack(side="left", padx=(10, 0))
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add("write", lambda *args: self._schedule_filter())
+        tk.Entry(top, textvariable=self.filter_var).pack(side="left", fill="x", expand=True, padx=5)
+
+        body = tk.Frame(parent)
+        body.pack(fill="both", expand=True)
+        self.tree = ttk.Treeview(body, columns=("check", "name", "status"), show="headings", selectmode="extended")
+        self.tree.heading("check", text="")
+        self.tree.heading("name", text=title)
+        self.tree.heading("status", text="状态")
+        self.tree.column("check", width=30, stretch=False, anchor="center")
+        self.tree.column("name", width=300)
+        self.tree.column("status", width=80, stretch=False, anchor="center")
+        scrollbar = ttk.Scrollbar(body, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+        # 点击勾选列切换单行，空格键切换所有选中的行
+        self.tree.bind("<Button-1>", self._on_click)
+        self.tree.bind("<space>", lambda e: self.toggle(self.tree.selection()))
+
+    def _values(self, path):
+        return (self.CHECKED if path in self.checked else self.UNCHECKED, path, self.status.get(path, ""))
+
+    def _matches(self, path):
+        text = self._filter_text
+        return not text or text in path.lower() or text in self.status.get(path, "").lower()
+
+    def clear(self):
+        self._pending = []
+        if self._inserted:
+            self.tree.delete(*self._inserted)
+        self.paths, self.visible = [], []
+        self._inserted.clear()
+        self.checked.clear()
+        self.status.clear()
+
+    def add(self, paths):
+        """加入新文件（paths 已排序），默认勾选。"""
+        if not paths:
+            return
+        self.checked.update(paths)
+        if not self.paths and not self._pending:
+            # 首次载入：整批按顺序追加，分块插入 Treeview
+            self.paths = list(paths)
+            self._pending = list(reversed(self.paths))
+            self.tree.after_idle(self._insert_pending)
+            return
+        self._flush_pending()
+        for path in paths:
+            bisect.insort(self.paths, path)
+            self._insert(path)
+
+    def _insert(self, path):
+        if self._matches(path):
+            pos = bisect.bisect(self.visible, path)
+            self.visible.insert(pos, path)
+            self.tree.insert("", pos, iid=path, values=self._values(path))
+        else:
+            self.tree.insert("", "end", iid=path, values=self._values(path))
+            self.tree.detach(path)
+        self._inserted.add(path)
+
+    def _insert_pending(self):
+        for _ in range(min(self.INSERT_CHUNK, len(self._pending))):
+            path = self._pending.pop()
+            if self._matches(path):
+                self.visible.append(path)
+                self.tree.insert("", "end", iid=path, values=self._values(path))
+            else:
+                self.tree.insert("", "end", iid=path, values=self._values(path))
+                self.tree.detach(path)
+            self._inserted.add(path)
+        if self._pending:
+            self.tree.after(1, self._insert_pending)
+
+    def _flush_pending(self):
+        while self._pending:
+            self._insert_pending()
+
+    def remove(self, paths):
+        self._flush_pending()
+        gone = [p for p in paths if p in self._inserted]
+        if not gone:
+            return
+        self.tree.delete(*gone)
+        gone = set(gone)
+        self._inserted -= gone
+        self.checked -= gone
+        self.paths = [p for p in self.paths if p not in gone]
+        self.visible = [p for p in self.visible if p not in gone]
+        for p in gone:
+            self.status.pop(p, None)
+
+    def set_status(self, path, text):
+        if self.status.get(path, "") == text:
+            return
+        self.status[path] = text
+        if path in self._inserted:
+            self.tree.set(path, "status", text)
+
+    def toggle(self, paths):
+        for path in paths:
+            if path in self.checked:
+                self.checked.discard(path)
+            else:
+                self.checked.add(path)
+            self.tree.set(path, "check", self._values(path)[0])
+
+    def toggle_all(self):
+        self._flush_pending()
+        value = self.select_all_var.get()
+        mark = self.CHECKED if value else self.UNCHECKED
+        for path in self.visible:
+            if (path in self.checked) != value:
+                if value:
+                    self.checked.add(path)
+                else:
+                    self.checked.discard(path)
+                self.tree.set(path, "check", mark)
+
+    def _on_click(self, event):
+        if self.tree.identify_region(event.x, event.y) != "cell" or self.tree.identify_column(event.x) != "#1":
+            return None
+        row = self.tree.identify_row(event.y)
+        if row:
+            self.toggle([row])
+        return "break"
+
+    def _schedule_filter(self):
+        # 输入时稍等再过滤，避免每敲一个字都重排整个列表
+        if self._filter_job is not None:
+            self.tree.after_cancel(self._filter_job)
+        self._filter_job = self.tree.after(200, self._apply_filter)
+
+    def _apply_filter(self):
+        self._filter_job = None
+        self._flush_pending()
+        self._filter_text = self.filter_var.get().strip().lower()
+        visible = [p for p in self.paths if self._matches(p)]
+        if self.visible:
+            self.tree.detach(*self.visible)
+        for pos, path in enumerate(visible):
+            self.tree.move(path, "", pos)
+        self.visible = visible
+
+    def selected_paths(self):
+        """可见且勾选的文件，按路径排序。"""
+        self._flush_pending()
+        return [p for p in self.visible if p in self.checked]
+
+    def all_paths(self):
+        self._flush_pending()
+        return list(self.visible)
 
 class SubtitleExtractorUI:
     def __init__(self, root):
@@ -44,11 +241,19 @@ class SubtitleExtractorUI:
         # 配置
         self.default_languages = ['eng']
         self.current_dir = tk.StringVar()
-        self.file_vars = {}
-        self.srt_vars = {}
-        self.srt_map = {}
-        self.subtitle_info = {}
+        # 提取/翻译过程中的文件状态，优先于扫描推断出的状态：{("video" 或 "srt", 相对路径): 状态}
+        self.live_status = {}
+        # 每次扫描目录递增，后台预读 ffprobe 时据此判断结果是否已过期
+        self.scan_generation = 0
+        # 目录文件索引，增量刷新时只增删有变化的条目
+        self.file_index = None
+        # 续传日志的翻译进度：{相对路径: (索引中的文件状态, (已写出, 总数))}，日志未变化时不重复读取
+        self.journal_progress = {}
+        self.scan_lock = threading.Lock()
+        self.watch_var = tk.BooleanVar(value=False)
+        self._watch_job = None
         self.log_queue = queue.Queue()
+        self.file_logger = self._open_log_file(LOG_FILE)
         self.dialog_queue = queue.Queue()
         self.api_keys = []
         self.target_language = "中文"
@@ -68,6 +273,7 @@ class SubtitleExtractorUI:
         tk.Label(frame_top, text=" 当前目录:").pack(side="left")
         self.dir_label = tk.Label(frame_top, textvariable=self.current_dir, width=50, anchor="w")
         self.dir_label.pack(side="left", padx=5)
+        tk.Checkbutton(frame_top, text="监视目录", variable=self.watch_var, command=self.toggle_watch).pack(side="right")
 
         # 列表框区域
         frame_lists = tk.Frame(root)
@@ -83,20 +289,7 @@ class SubtitleExtractorUI:
         self.extract_button.pack(side="right", padx=5)
         tk.Button(frame_videos_top, text="默认语言", command=self.set_default_languages, width=10, height=1).pack(side="right", padx=5)
         tk.Button(frame_videos_top, text="选择目录", command=self.select_directory, width=10, height=1).pack(side="right", padx=5)
-        self.select_all_var = tk.BooleanVar(value=True)
-        tk.Checkbutton(frame_videos, text="全选", variable=self.select_all_var, command=self.toggle_select_all).pack(anchor="w")
-
-        # 视频文件滚动区域
-        self.video_canvas = tk.Canvas(frame_videos, highlightthickness=0)
-        self.video_scrollbar = tk.Scrollbar(frame_videos, orient="vertical")
-        self.video_scrollbar.config(command=self.video_canvas.yview)
-        self.video_canvas.config(yscrollcommand=self.video_scrollbar.set)
-        self.video_scrollbar.pack(side="right", fill="y")
-        self.video_canvas.pack(side="left", fill="both", expand=True)
-        self.video_frame = tk.Frame(self.video_canvas)
-        self.video_window = self.video_canvas.create_window((0, 0), window=self.video_frame, anchor="nw")
-        self.video_frame.bind("<Configure>", self._update_video_scrollregion)
-        self.video_canvas.bind("<Configure>", lambda e: self._update_video_scrollregion())
+        self.video_list = FileList(frame_videos, "视频文件")
 
         # 右边：字幕文件
         frame_srt = tk.LabelFrame(frame_lists, text="")
@@ -108,20 +301,7 @@ class SubtitleExtractorUI:
         self.translate_button.pack(side="right", padx=5)
         tk.Button(frame_srt_top, text="目标语言", command=self.set_target_language, width=10, height=1).pack(side="right", padx=5)
         tk.Button(frame_srt_top, text="管理秘钥", command=self.manage_api_keys, width=10, height=1).pack(side="right", padx=5)
-        self.select_all_srt_var = tk.BooleanVar(value=True)
-        tk.Checkbutton(frame_srt, text="全选", variable=self.select_all_srt_var, command=self.toggle_select_all_srt).pack(anchor="w")
-
-        # 字幕文件滚动区域
-        self.srt_canvas = tk.Canvas(frame_srt, highlightthickness=0)
-        self.srt_scrollbar = tk.Scrollbar(frame_srt, orient="vertical")
-        self.srt_scrollbar.config(command=self.srt_canvas.yview)
-        self.srt_canvas.config(yscrollcommand=self.srt_scrollbar.set)
-        self.srt_scrollbar.pack(side="right", fill="y")
-        self.srt_canvas.pack(side="left", fill="both", expand=True)
-        self.srt_frame = tk.Frame(self.srt_canvas)
-        self.srt_window = self.srt_canvas.create_window((0, 0), window=self.srt_frame, anchor="nw")
-        self.srt_frame.bind("<Configure>", self._update_srt_scrollregion)
-        self.srt_canvas.bind("<Configure>", lambda e: self._update_srt_scrollregion())
+        self.srt_list = FileList(frame_srt, "字幕文件")
 
         # 日志区域容器
         self.log_container = tk.Frame(self.root)
@@ -210,129 +390,197 @@ class SubtitleExtractorUI:
         except Exception as e:
             self.log(f"❌ 保存API密钥失败: {e}")
 
-    def _update_video_scrollregion(self, event=None):
-        self.video_canvas.configure(scrollregion=self.video_canvas.bbox("all"))
-
-    def _update_srt_scrollregion(self, event=None):
-        self.srt_canvas.configure(scrollregion=self.srt_canvas.bbox("all"))
+    def _open_log_file(self, path):
+        if not path:
+            return None
+        logger = logging.getLogger("subtitlecat")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        try:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding="utf-8")
+        except OSError as e:
+            print(f"⚠️ 无法打开日志文件 {path}: {e}")
+            return None
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+        return logger
 
     def log(self, msg: str):
+        # 任何线程都可以调用：只入队，由 check_log_queue 在界面线程中批量写入
         self.log_queue.put(msg)
-        self.root.after(0, self._process_single_log)
+        if self.file_logger:
+            self.file_logger.info(msg)
 
-    def _process_single_log(self):
+    def check_log_queue(self):
+        # 每次取出队列中的全部消息，一次插入；一次涌入过多时只保留最后 LOG_MAX_LINES 行
+        batch = deque(maxlen=LOG_MAX_LINES)
         try:
-            msg = self.log_queue.get_nowait()
+            while True:
+                batch.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if batch:
             self.log_text.config(state="normal")
-            self.log_text.insert("end", msg + "\n")
+            self.log_text.insert("end", "\n".join(batch) + "\n")
+            # 末尾总有一个空行，实际行数比 end 的行号少 1
+            excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - LOG_MAX_LINES
+            if excess > 0:
+                self.log_text.delete("1.0", f"{excess + 1}.0")
             self.log_text.see("end")
             self.log_text.config(state="disabled")
-            self.root.update_idletasks()
-        except queue.Empty:
-            pass
-
-    def check_log_queue(self):
-        max_messages_per_cycle = 10
-        for _ in range(max_messages_per_cycle):
-            self._process_single_log()
-        self.root.after(50, self.check_log_queue)
+        self.root.after(LOG_INTERVAL, self.check_log_queue)
 
     def select_directory(self):
         dir_path = filedialog.askdirectory()
         if dir_path:
             self.current_dir.set(dir_path)
-            self.refresh_video_files()
-
-    def refresh_video_files(self):
-        for widget in self.video_frame.winfo_children():
-            widget.destroy()
-        for widget in self.srt_frame.winfo_children():
-            widget.destroy()
-        self.file_vars.clear()
-        self.srt_vars.clear()
-        self.srt_map.clear()
-        self.subtitle_info.clear()
+            self.refresh_video_files(full=True)
+
+    def refresh_video_files(self, full=False):
+        """在后台线程扫描目录，扫描完成后只增删有变化的条目，不阻塞界面。"""
+        threading.Thread(target=self.scan_files, args=(self.current_dir.get(), full), daemon=True).start()
+
+    def scan_files(self, root_dir, full=False):
+        """扫描目录并等界面应用完结果再返回；会阻塞，只能在后台线程调用。"""
+        with self.scan_lock:
+            index = self.file_index
+            if not root_dir:
+                index = None
+            elif index is None or index.root != root_dir:
+                index = FileIndex(root_dir)
+            try:
+                changes = index.scan(full) if index else None
+            except Exception as e:
+                self.log(f"⚠️ 扫描目录失败: {e}")
+                return
+            self.file_index = index
+            applied = threading.Event()
 
-        if not self.current_dir.get():
+            def apply():
+                try:
+                    self._apply_scan(index, changes)
+                finally:
+                    applied.set()
+
+            self.root.after(0, apply)
+            applied.wait()
+
+    def _apply_scan(self, index, changes):
+        if index is None or changes.reset:
+            self.video_list.clear()
+            self.srt_list.clear()
+            self.live_status.clear()
+        if index is None or not changes:
             return
 
-        # 扫描所有子目录中的视频文件
-        video_files = []
-        for root, _, files in os.walk(self.current_dir.get()):
-            for f in files:
-                if f.lower().endswith((".mp4", ".mkv")):
-                    # 存储相对路径以显示子目录结构
-                    rel_path = os.path.relpath(os.path.join(root, f), self.current_dir.get())
-                    video_files.append(rel_path)
-        video_files.sort()
-
-        for f in video_files:
-            var = tk.BooleanVar(value=True)
-            cb = tk.Checkbutton(self.video_frame, text=f, variable=var)
-            cb.pack(anchor="w")
-            self.file_vars[f] = var
-
-            # 检查对应的字幕文件
-            srt_path = os.path.splitext(os.path.join(self.current_dir.get(), f))[0] + ".srt"
-            if os.path.exists(srt_path):
-                srt_file = srt_path
+        self.video_list.remove(changes.removed)
+        self.srt_list.remove(changes.removed)
+        added_videos = [p for p in changes.added if index.files[p][0] == "video"]
+        self.video_list.add(added_videos)
+        self.srt_list.add([p for p in changes.added if index.files[p][0] == "srt"])
+        self._refresh_statuses(index)
+
+        changed_videos = [p for p in changes.changed if index.files[p][0] == "video"]
+        self.start_probe_prefetch([os.path.join(index.root, f) for f in added_videos + changed_videos],
+                                  new_scan=changes.reset)
+
+    def _translation_progress(self, index):
+        """
+        返回 {字幕路径（不含扩展名）: (已写出, 总数)}。有续传日志时以日志最后一个检查点为准，
+        中途停止或崩溃的文件不会显示为已翻译；只有输出没有日志（旧版本生成）或旧日志没有记录总数时视为已完成。
+        """
+        progress = {p.split(".Dex7er.")[0]: (1, 1) for p in index.paths("output")}
+        journaled = {}
+        cache = {}
+        for path in index.paths("journal"):
+            state = index.files[path]
+            cached = self.journal_progress.get(path)
+            if not cached or cached[0] != state:
+                cached = (state, read_progress(os.path.join(index.root, path)))
+            cache[path] = cached
+            written, total = cached[1] or (0, None)
+            if total is None:
+                continue
+            base = path.split(".Dex7er.")[0]
+            old = journaled.get(base)
+            # 同一字幕有多种输出格式的日志时取进度最多的一份
+            if not old or written / max(total, 1) > old[0] / max(old[1], 1):
+                journaled[base] = (written, total)
+        self.journal_progress = cache
+        progress.update(journaled)
+        return progress
+
+    def _refresh_statuses(self, index):
+        # 直接查索引推断状态，不逐个 os.path.exists：
+        # 视频旁有 <视频名>.*.srt 为已提取；字幕旁有 <字幕名>.Dex7er.* 输出时按续传日志区分已翻译和部分翻译
+        srts = index.paths("srt")
+        progress = self._translation_progress(index)
+        for path in self.video_list.paths:
+            prefix = os.path.splitext(path)[0] + "."
+            pos = bisect.bisect_left(srts, prefix)
+            extracted = pos < len(srts) and srts[pos].startswith(prefix)
+            status = self.live_status.get(("video", path), "已提取" if extracted else "")
+            self.video_list.set_status(path, status)
+        for path in self.srt_list.paths:
+            written, total = progress.get(os.path.splitext(path)[0], (0, 0))
+            if not total:
+                status = ""
+            elif written >= total:
+                status = "已翻译"
             else:
-                srt_file = "未找到字幕"
-            self.srt_map[f] = srt_file
-
-        # 扫描字幕文件
-        srt_files = []
-        for root, _, files in os.walk(self.current_dir.get()):
-            for f in files:
-                if f.lower().endswith((".srt")):
-                    srt_files.append(os.path.relpath(os.path.join(root, f), self.current_dir.get()))
-        srt_files.sort()
-        for f in srt_files:
-            var = tk.BooleanVar(value=True)
-            cb = tk.Checkbutton(self.srt_frame, text=f, variable=var)
-            cb.pack(anchor="w")
-            self.srt_vars[f] = var
+                status = f"部分翻译 {written}/{total}"
+            self.srt_list.set_status(path, self.live_status.get(("srt", path), status))
+
+    def _clear_pending_status(self, statuses):
+        # 翻译出错退出后，仍显示等待/翻译中的文件交给下一次扫描按续传日志判断
+        for key in [k for k, status in self.live_status.items() if status in statuses]:
+            del self.live_status[key]
+
+    def set_file_status(self, kind, path, status):
+        """在工作线程中更新文件状态；path 为绝对路径或相对当前目录的路径。"""
+        rel = os.path.relpath(path, self.current_dir.get()) if os.path.isabs(path) else path
+
+        def apply():
+            self.live_status[(kind, rel)] = status
+            (self.video_list if kind == "video" else self.srt_list).set_status(rel, status)
+
+        self.root.after(0, apply)
+
+    def toggle_watch(self):
+        if self._watch_job is not None:
+            self.root.after_cancel(self._watch_job)
+            self._watch_job = None
+        if self.watch_var.get():
+            self.log(f"✔ 已开启目录监视，每 {WATCH_INTERVAL // 1000} 秒检查一次新文件")
+            self._watch_job = self.root.after(WATCH_INTERVAL, self._watch_tick)
+        else:
+            self.log("✔ 已关闭目录监视")
+
+    def _watch_tick(self):
+        # 上一次扫描还没结束时跳过这一轮
+        if self.current_dir.get() and not self.scan_lock.locked():
+            self.refresh_video_files()
+        self._watch_job = self.root.after(WATCH_INTERVAL, self._watch_tick)
 
-        self.video_canvas.configure(scrollregion=self.video_canvas.bbox("all"))
-        self.srt_canvas.configure(scrollregion=self.srt_canvas.bbox("all"))
+    def start_probe_prefetch(self, video_paths, new_scan=True):
+        # 扫描后在后台读取字幕流信息并缓存，提取和设置默认语言时不再等待 ffprobe；
+        # 重新扫描目录时让上一次未完成的预读停下，增量扫描只预读新增的视频
+        if new_scan:
+            self.scan_generation += 1
+        generation = self.scan_generation
 
-    def toggle_select_all(self):
-        for var in self.file_vars.values():
-            var.set(self.select_all_var.get())
+        def run():
+            try:
+                prefetch_probes(video_paths, log=self.log, stop_flag=lambda: generation != self.scan_generation)
+            except Exception as e:
+                self.log(f"⚠️ 后台读取字幕流信息失败: {e}")
 
-    def toggle_select_all_srt(self):
-        for var in self.srt_vars.values():
-            var.set(self.select_all_srt_var.get())
+        if video_paths:
+            threading.Thread(target=run, daemon=True).start()
 
     def probe_subtitles(self, video_path):
-        try:
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = subprocess.SW_HIDE  # 完全隐藏
-            result = subprocess.run(
-                ["ffprobe", "-v", "error", "-select_streams", "s",
-                 "-show_entries", "stream=index:stream_tags=language,title",
-                 "-of", "default=noprint_wrappers=1", video_path],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True, startupinfo=startupinfo
-            )
-            lines = result.stdout.strip().splitlines()
-            subs = []
-            current = {}
-            for line in lines:
-                if line.startswith("index="):
-                    if current:
-                        subs.append(current)
-                    current = {"index": line.split("=")[1]}
-                elif line.startswith("TAG:language="):
-                    current["lang"] = line.split("=")[1]
-                elif line.startswith("TAG:title="):
-                    current["title"] = line.split("=", 1)[1]
-            if current:
-                subs.append(current)
-            return subs
-        except Exception as e:
-            self.log(f"⚠️ ffprobe 出错: {e}")
-            return []
+        return probe_subtitles(video_path, log=self.log)
 
     def subtitle_selection_dialog(self, subs, response_queue=None, default_eng=True):
         win = tk.Toplevel(self.root)
@@ -342,7 +590,7 @@ class SubtitleExtractorUI:
 
         for sub in subs:
             var = tk.BooleanVar(value=default_eng and sub.get("lang") == "eng")
-            desc = f"流 {sub.get('index')} - 语言:{sub.get('lang','?')} 标题:{sub.get('title','')}"
+            desc = f"流 {sub.get('index')} - 语言:{sub.get('lang','?')} 格式:{sub.get('codec','?')} 标题:{sub.get('title','')}"
             cb = tk.Checkbutton(win, text=desc, variable=var)
             cb.pack(anchor="w")
             sub_vars[sub['index']] = var
@@ -376,9 +624,9 @@ class SubtitleExtractorUI:
         if not self.current_dir.get():
             messagebox.showwarning("警告", "请先选择目录")
             return
-        video_files = [f for f in self.file_vars if self.file_vars[f].get()]
+        video_files = self.video_list.selected_paths()
         if not video_files:
-            video_files = list(self.file_vars.keys())
+            video_files = self.video_list.all_paths()
         if not video_files:
             messagebox.showinfo("提示", "没有视频文件")
             return
@@ -487,11 +735,16 @@ class SubtitleExtractorUI:
 
     def run_translation(self, selected_srt, target_lang_code):
         from translate import translate_files
+        labels = {"waiting": "等待翻译", "translating": "翻译中", "done": "已翻译", "stopped": "已停止"}
+        for f in selected_srt:
+            self.set_file_status("srt", f, labels["waiting"])
         try:
-            translate_files(selected_srt, target_lang_code, log=self.log, stop_flag=lambda: self.stop_translation)
+            translate_files(selected_srt, target_lang_code, log=self.log, stop_flag=lambda: self.stop_translation,
+                            api_keys=self.api_keys, status=lambda f, state: self.set_file_status("srt", f, labels[state]))
         except Exception as e:
             self.log(f"❌ 翻译过程中发生错误: {e}")
         finally:
+            self.root.after(0, self._clear_pending_status, [labels["waiting"], labels["translating"]])
             self.is_translating = False
             self.stop_translation = False
             self.translate_button.config(text="翻译字幕", state="normal")
@@ -508,7 +761,7 @@ class SubtitleExtractorUI:
             messagebox.showwarning("警告", "请先选择目录")
             return
 
-        selected_srt = [os.path.abspath(os.path.join(self.current_dir.get(), f)) for f, v in self.srt_vars.items() if v.get()]
+        selected_srt = [os.path.abspath(os.path.join(self.current_dir.get(), f)) for f in self.srt_list.selected_paths()]
         if not selected_srt:
             messagebox.showinfo("提示", "没有选中任何字幕文件")
             return
@@ -528,55 +781,36 @@ class SubtitleExtractorUI:
         target_lang_code = self.language_map.get(self.target_language, "zh")
         threading.Thread(target=self.run_translation, args=(selected_srt, target_lang_code), daemon=True).start()
 
+    def choose_streams(self, video_path, subs):
+        matching_streams = [sub for sub in subs if sub.get('lang') in self.default_languages]
+        if matching_streams:
+            return matching_streams
+        self.log(f"需要用户为 {os.path.relpath(video_path, self.current_dir.get())} 选择字幕流")
+        response_queue = queue.Queue()
+        self.root.after(0, lambda: self.show_subtitle_selection_dialog(subs, response_queue))
+        selected_indices = response_queue.get()
+        return [sub for sub in subs if sub['index'] in selected_indices]
+
     def run_extraction(self, selected_files, callback=None):
-        for idx, f in enumerate(selected_files, start=1):
-            if self.stop_translation:
-                self.log("⚠️ 提取被停止")
-                break
-            video_path = os.path.abspath(os.path.join(self.current_dir.get(), f))
-            subs = self.probe_subtitles(video_path)
-            if not subs:
-                self.log(f"❌ {f} 没找到字幕流")
-                continue
+        video_paths = [os.path.abspath(os.path.join(self.current_dir.get(), f)) for f in selected_files]
+        for f in selected_files:
+            self.set_file_status("video", f, "等待提取")
 
-            matching_streams = [sub for sub in subs if sub.get('lang') in self.default_languages]
-            if matching_streams:
-                to_extract = matching_streams
-            else:
-                self.log(f"需要用户为 {f} 选择字幕流")
-                response_queue = queue.Queue()
-                self.root.after(0, lambda: self.show_subtitle_selection_dialog(subs, response_queue))
-                selected_indices = response_queue.get()
-                to_extract = [sub for sub in subs if sub['index'] in selected_indices]
-
-            for sub in to_extract:
-                if self.stop_translation:
-                    self.log("⚠️ 提取被停止")
-                    break
-                subtitle_lang = sub.get('lang', 'unknown')
-                srt_path = os.path.splitext(video_path)[0] + f".{subtitle_lang}.srt"
-                cmd = [
-                    "ffmpeg",
-                    "-y",
-                    "-i", video_path,
-                    "-map", f"0:{sub['index']}",
-                    "-c:s", "srt",
-                    srt_path
-                ]
-                self.log(f"[{idx}] {' '.join(cmd)}")
-                try:
-                    startupinfo = subprocess.STARTUPINFO()
-                    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                    startupinfo.wShowWindow = subprocess.SW_HIDE
-                    subprocess.run(cmd, check=True, startupinfo=startupinfo)
-                except subprocess.CalledProcessError as e:
-                    self.log(f"❌ 提取失败: {f} ({subtitle_lang})，错误: {e}")
+        def progress(done, total, video_path, files):
+            self.set_file_status("video", video_path, "已提取" if files else "提取失败")
+
+        try:
+            extract_videos(video_paths, self.choose_streams, log=self.log, stop_flag=lambda: self.stop_translation,
+                           max_workers=EXTRACT_WORKERS, progress=progress)
+        except Exception as e:
+            self.log(f"❌ 提取过程中发生错误: {e}")
 
         self.log("✔ 所有提取任务完成")
         self.is_extracting = False
         self.extract_button.config(state="normal")
         self.one_click_button.config(state="normal")
-        self.root.after(0, self.refresh_video_files)
+        # 等新提取的字幕出现在列表中，一键翻译才能选中它们
+        self.scan_files(self.current_dir.get())
         if callback:
             callback()
 
@@ -588,7 +822,7 @@ class SubtitleExtractorUI:
         if not self.current_dir.get():
             messagebox.showwarning("警告", "请先选择目录")
             return
-        selected_files = [f for f, v in self.file_vars.items() if v.get()]
+        selected_files = self.video_list.selected_paths()
         if not selected_files:
             messagebox.showinfo("提示", "没有选中任何视频文件")
             return
@@ -610,7 +844,7 @@ class SubtitleExtractorUI:
         if not self.current_dir.get():
             messagebox.showwarning("警告", "请先选择目录")
             return
-        selected_files = [f for f, v in self.file_vars.items() if v.get()]
+        selected_files = self.video_list.selected_paths()
         if not selected_files:
             messagebox.showinfo("提示", "没有选中任何视频文件")
             return
@@ -630,7 +864,7 @@ class SubtitleExtractorUI:
         self.translate_button.config(state="disabled")
 
         def after_extraction():
-            selected_srt = [os.path.abspath(os.path.join(self.current_dir.get(), f)) for f, v in self.srt_vars.items() if v.get()]
+            selected_srt = [os.path.abspath(os.path.join(self.current_dir.get(), f)) for f in self.srt_list.selected_paths()]
             if not selected_srt:
                 self.log("❌ 没有找到字幕文件进行翻译")
                 self.is_translating = False
@@ -0,0 +1,151 @@
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """
+    简单令牌桶：按每分钟额度匀速补充，桶容量即突发上限。per_minute <= 0 表示不限制。
+    """
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        if self.capacity <= 0:
+            return 0
+        self._refill(now)
+        # 单次请求超过桶容量时按满桶计算，避免永远等不到
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount, now):
+        if self.capacity <= 0:
+            return
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+class KeyState:
+    def __init__(self, key, rpm, tpm):
+        self.key = key
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.disabled = False
+
+    @property
+    def label(self):
+        return f"{self.key[:4]}..."
+
+
+class KeyPool:
+    """
+    进程级 API key 池，线程和协程共用。
+    每个 key 有 RPM/TPM 令牌桶、在途请求上限和冷却时间；acquire 总是挑选当前可用且负载最低的 key，
+    冷却结束的 key 自动重新参与调度。只有所有 key 都被禁用时才报告“所有 API key 已用尽”。
+    """
+    def __init__(self, api_keys, rpm=0, tpm=0, max_in_flight=0):
+        keys = list(dict.fromkeys(k for k in api_keys if k))
+        if not keys:
+            raise Exception("没有有效的 API Key")
+        self.states = [KeyState(k, rpm, tpm) for k in keys]
+        self.max_in_flight = max_in_flight
+        self.lock = threading.Lock()
+
+    @property
+    def active_count(self):
+        return sum(1 for st in self.states if not st.disabled)
+
+    def try_acquire(self, tokens=0):
+        """
+        尝试占用一个 key。成功返回 (KeyState, 0)，否则返回 (None, 建议等待秒数)。
+        """
+        now = time.monotonic()
+        with self.lock:
+            best = None
+            wait = None
+            for st in self.states:
+                if st.disabled:
+                    continue
+                w = max(st.cooldown_until - now, 0)
+                if self.max_in_flight > 0 and st.in_flight >= self.max_in_flight:
+                    # 等待在途请求释放，没有确切时间，短轮询
+                    w = max(w, 0.05)
+                w = max(w, st.rpm.wait_time(1, now), st.tpm.wait_time(tokens, now))
+                if w > 0:
+                    wait = w if wait is None else min(wait, w)
+                elif best is None or (st.in_flight, st.requests) < (best.in_flight, best.requests):
+                    best = st
+            if best is None:
+                if wait is None:
+                    raise Exception("所有 API key 已用尽")
+                return None, wait
+            best.rpm.take(1, now)
+            best.tpm.take(tokens, now)
+            best.in_flight += 1
+            best.requests += 1
+            return best, 0
+
+    def acquire(self, tokens=0, stop_flag=None):
+        while True:
+            state, wait = self.try_acquire(tokens)
+            if state:
+                return state
+            if stop_flag and stop_flag():
+                return None
+            time.sleep(min(wait, 1.0))
+
+    async def acquire_async(self, tokens=0, stop_flag=None):
+        while True:
+            state, wait = self.try_acquire(tokens)
+            if state:
+                return state
+            if stop_flag and stop_flag():
+                return None
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, state, ok=True):
+        with self.lock:
+            state.in_flight -= 1
+            if ok:
+                state.failures = 0
+
+    def record_failure(self, state):
+        with self.lock:
+            state.failures += 1
+            return state.failures
+
+    def cooldown(self, state, seconds):
+        with self.lock:
+            state.cooldown_until = max(state.cooldown_until, time.monotonic() + seconds)
+            state.failures = 0
+
+    def disable(self, state):
+        with self.lock:
+            state.disabled = True
+
+    def summary(self):
+        now = time.monotonic()
+        with self.lock:
+            return [
+                {
+                    "key": st.label,
+                    "requests": st.requests,
+                    "in_flight": st.in_flight,
+                    "cooldown": round(max(st.cooldown_until - now, 0), 1),
+                    "disabled": st.disabled,
+                }
+                for st in self.states
+            ]
@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# Prometheus 文本格式的导出文件（可交给 node_exporter 的 textfile collector），为空表示不导出
+PROMETHEUS_FILE = ""
+# 翻译过程中刷新 PROMETHEUS_FILE 的间隔（秒）
+EXPORT_INTERVAL = 15.0
+PREFIX = "subtitlecat"
+
+# 计数器名 -> (标签名, 说明)；标签名为空的计数器没有标签
+COUNTERS = {
+    "calls": ("kind", "Logical translation calls by kind (batch, repair, single)"),
+    "requests": ("result", "Gemini API attempts by result"),
+    "retries": ("reason", "Retried API attempts by error class"),
+    "key_rotations": ("", "Retries that switched to a different API key"),
+    "tokens": ("kind", "Tokens reported in response usage metadata"),
+    "memory_lookups": ("result", "Translation memory lookups by result"),
+    "dedup_saved_lines": ("", "Lines merged into another line's translation unit"),
+    "probe_lookups": ("result", "ffprobe cache lookups by result"),
+    "extracted_streams": ("result", "Subtitle streams extracted by result"),
+    "context_cache": ("result", "Explicit context caches created or failed"),
+}
+
+# 各阶段的中文名，用于日志摘要
+STAGE_NAMES = {
+    "parse": "解析", "clean": "清洗", "prompt": "构建提示词", "key_wait": "等待 key", "api": "API 调用",
+    "response": "解析回复", "write": "写出", "checkpoint": "落盘", "probe": "ffprobe", "extract": "ffmpeg",
+}
+
+
+class Metrics:
+    """
+    进程内的计时和计数器，线程安全。计数器只增不减（与 Prometheus counter 一致），
+    单次运行的统计用开始时的 snapshot() 与结束时的 summary(since) 相减得到。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # 阶段 -> [次数, 总秒数, 单次最长秒数]
+        self.stages = {}
+        # (计数器名, 标签值) -> 数值
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, name, label="", amount=1):
+        if not amount:
+            return
+        with self.lock:
+            self.counters[(name, label)] = self.counters.get((name, label), 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "time": time.monotonic(),
+                "stages": {stage: list(entry) for stage, entry in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+    def summary(self, since=None):
+        """
+        返回 JSON 友好的统计字典：各阶段耗时、请求/重试/key 切换次数、token 数和缓存命中率。
+        since 为之前的 snapshot() 时只统计其后的部分（单次运行），单次最长耗时仍取累计值。
+        """
+        now = self.snapshot()
+        base = since or {"time": now["time"], "stages": {}, "counters": {}}
+        stages = {}
+        for stage, (count, total, longest) in now["stages"].items():
+            old = base["stages"].get(stage, [0, 0.0, 0.0])
+            if count - old[0]:
+                stages[stage] = {"count": count - old[0], "seconds": round(total - old[1], 3), "max": round(longest, 3)}
+        counters = {}
+        for (name, label), value in now["counters"].items():
+            value -= base["counters"].get((name, label), 0)
+            if value:
+                if COUNTERS.get(name, ("",))[0]:
+                    counters.setdefault(name, {})[label] = value
+                else:
+                    counters[name] = value
+        for name in ("memory_lookups", "probe_lookups"):
+            lookups = counters.get(name)
+            if lookups:
+                lookups["hit_rate"] = round(lookups.get("hit", 0) / (lookups.get("hit", 0) + lookups.get("miss", 0)), 3)
+        result = {"stages": stages, **counters}
+        if since:
+            result["seconds"] = round(now["time"] - since["time"], 3)
+        return result
+
+    def prometheus(self):
+        """累计值的 Prometheus 文本格式。"""
+        snap = self.snapshot()
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds_total Wall time spent per pipeline stage",
+            f"# TYPE {PREFIX}_stage_seconds_total counter",
+        ]
+        lines += [f'{PREFIX}_stage_seconds_total{{stage="{stage}"}} {entry[1]:.6f}'
+                  for stage, entry in sorted(snap["stages"].items())]
+        lines += [
+            f"# HELP {PREFIX}_stage_calls_total Number of timed calls per pipeline stage",
+            f"# TYPE {PREFIX}_stage_calls_total counter",
+        ]
+        lines += [f'{PREFIX}_stage_calls_total{{stage="{stage}"}} {entry[0]}' for stage, entry in sorted(snap["stages"].items())]
+        for name, (label_name, help_text) in COUNTERS.items():
+            values = sorted((label, value) for (n, label), value in snap["counters"].items() if n == name)
+            if not values:
+                continue
+            lines.append(f"# HELP {PREFIX}_{name}_total {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            for label, value in values:
+                labels = f'{{{label_name}="{label}"}}' if label_name else ""
+                lines.append(f"{PREFIX}_{name}_total{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path=None):
+        """把 Prometheus 文本写入 path（默认 PROMETHEUS_FILE）。先写临时文件再替换，采集方不会读到半个文件。"""
+        path = path or PROMETHEUS_FILE
+        if not path:
+            return
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+
+def format_summary(summary):
+    """把 summary() 的结果压缩成一行日志。"""
+    parts = []
+    for stage, entry in summary.get("stages", {}).items():
+        parts.append(f"{STAGE_NAMES.get(stage, stage)} {entry['seconds']:.2f}s/{entry['count']} 次")
+    text = "耗时: " + ("，".join(parts) or "无")
+    requests = summary.get("requests", {})
+    if requests:
+        text += f"；请求 {sum(requests.values())} 次（失败 {requests.get('error', 0)}）"
+    retries = summary.get("retries", {})
+    if retries:
+        text += "，重试 " + " ".join(f"{reason}×{count}" for reason, count in retries.items())
+    if summary.get("key_rotations"):
+        text += f"，切换 key {summary['key_rotations']} 次"
+    tokens = summary.get("tokens", {})
+    if tokens:
+        text += f"；token 输入 {tokens.get('input', 0)} / 输出 {tokens.get('output', 0)}"
+        if tokens.get("cached"):
+            text += f" / 缓存 {tokens['cached']}"
+    lookups = summary.get("memory_lookups")
+    if lookups:
+        text += f"；翻译记忆命中率 {lookups['hit_rate']:.0%}"
+    return text
+
+
+METRICS = Metrics()
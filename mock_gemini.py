@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+本地的 Gemini 替身服务，用于离线测试和基准测试，不需要真实 key 和网络：
+    python mock_gemini.py --port 8765 --latency 0.5 --rate-429 0.05
+    python cli.py ko --base-url http://127.0.0.1:8765 --api-key test
+实现 generateContent 和 cachedContents（上下文缓存的创建、删除）：按提示词末尾的 index|||text（或 JSON 数组）
+逐行返回假译文，可以模拟延迟、429（带 RetryInfo）、503、每个 key 的 RPM 配额，以及丢失或写错索引的回复。
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_GENERATE_PATH = re.compile(r"^/v1(?:beta|alpha)?/models/([^/:]+):generateContent$")
+_CACHES_PATH = re.compile(r"^/v1(?:beta|alpha)?/cachedContents$")
+_CACHE_PATH = re.compile(r"^/v1(?:beta|alpha)?/(cachedContents/[^/]+)$")
+
+
+def fake_translation(text):
+    """替身服务返回的译文，基准测试据此校验每一行是否对得上。"""
+    return f"译文:{text}"
+
+
+def count_tokens(text):
+    # 与 translate.estimate_tokens 相同的粗略估算，只用于填写 usageMetadata
+    ascii_count = len(text.encode("ascii", "ignore"))
+    return ascii_count // 4 + (len(text) - ascii_count) + 1
+
+
+def parse_prompt_items(prompt):
+    """
+    从提示词中取出待翻译的行，返回 [(index, text), ...]。
+    输入行在最后一个空行之后：index|||text 逐行排列，或 JSON 模式下的 [{"index", "text"}] 数组；
+    [context] 开头的上下文行不需要回复。
+    """
+    block = prompt.rsplit("\n\n", 1)[-1].strip()
+    if block.startswith("["):
+        try:
+            data = json.loads(block)
+            return [(item["index"], item["text"]) for item in data if isinstance(item, dict) and "index" in item]
+        except (ValueError, KeyError, TypeError):
+            pass
+    items = []
+    for line in block.splitlines():
+        if "|||" in line:
+            idx, text = line.split("|||", 1)
+            if idx.strip().isdigit():
+                items.append((int(idx), text))
+    return items
+
+
+def content_text(content):
+    return "\n".join(part.get("text", "") for part in (content or {}).get("parts", []))
+
+
+def error_body(code, status, message, retry_delay=None):
+    error = {"code": code, "message": message, "status": status}
+    if retry_delay is not None:
+        error["details"] = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_delay}s"}]
+    return {"error": error}
+
+
+class MockGemini:
+    """
+    在后台线程中运行的替身服务。base_url 可以直接赋给 translate.BASE_URL。
+    latency ± jitter 为每个请求的基础延迟（秒），line_latency 为每行额外的延迟；
+    rate_429 / rate_503 为随机返回错误的概率；rpm 大于 0 时按 key 统计每分钟请求数，超出即返回 429；
+    drop_rate / garble_rate 为回复中每一行被省略或写错索引的概率；
+    cache_min_tokens 为上下文缓存的最小 token 数，内容不足时与真实 API 一样返回 400。
+    stats 记录请求数、各类错误数、token 数和上下文缓存的创建/删除次数。
+    """
+    def __init__(self, host="127.0.0.1", port=0, latency=0.2, jitter=0.0, line_latency=0.0, rate_429=0.0, rate_503=0.0,
+                 retry_delay=1, rpm=0, drop_rate=0.0, garble_rate=0.0, cache_min_tokens=1024, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.line_latency = line_latency
+        self.rate_429 = rate_429
+        self.rate_503 = rate_503
+        self.retry_delay = retry_delay
+        self.rpm = rpm
+        self.drop_rate = drop_rate
+        self.garble_rate = garble_rate
+        self.cache_min_tokens = cache_min_tokens
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.key_requests = {}
+        # 缓存名 -> (所属 key, system instruction, token 数)
+        self.caches = {}
+        self.stats = {"requests": 0, "ok": 0, "429": 0, "503": 0, "dropped": 0, "garbled": 0,
+                      "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "caches_created": 0, "caches_deleted": 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def _roll(self, rate):
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def _quota_wait(self, api_key):
+        """按 key 的滑动窗口统计 RPM，超出配额时返回需要等待的秒数，否则返回 0 并记一次请求。"""
+        if self.rpm <= 0:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            window = self.key_requests.setdefault(api_key, deque())
+            while window and now - window[0] >= 60:
+                window.popleft()
+            if len(window) >= self.rpm:
+                return max(1, int(60 - (now - window[0])) + 1)
+            window.append(now)
+            return 0
+
+    def _delay(self, lines):
+        with self.lock:
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter) + self.line_latency * lines
+        if delay > 0:
+            time.sleep(delay)
+
+    def _reply_lines(self, items, json_mode):
+        out = []
+        for idx, text in items:
+            if self._roll(self.drop_rate):
+                self._count("dropped")
+                continue
+            if self._roll(self.garble_rate):
+                # 写错索引：一半概率偏移索引，一半概率弄坏分隔符，两种都会被当作缺失行
+                self._count("garbled")
+                idx = idx + 100000 if self._roll(0.5) or json_mode else f"{idx}||"
+            out.append((idx, fake_translation(text)))
+        if json_mode:
+            return json.dumps([{"index": idx, "text": text} for idx, text in out], ensure_ascii=False)
+        return "\n".join(f"{idx}|||{text}" if isinstance(idx, int) else f"{idx}{text}" for idx, text in out)
+
+    def create_cache(self, api_key, body):
+        """处理 cachedContents.create，返回 (HTTP 状态码, 响应 JSON)。"""
+        system = content_text(body.get("systemInstruction"))
+        tokens = count_tokens(system + "".join(content_text(c) for c in body.get("contents") or []))
+        if tokens < self.cache_min_tokens:
+            return 400, error_body(400, "INVALID_ARGUMENT", f"Cached content is too small. total_token_count={tokens}, "
+                                                            f"min_total_token_count={self.cache_min_tokens}")
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        with self.lock:
+            self.caches[name] = (api_key, system, tokens)
+        self._count("caches_created")
+        return 200, {"name": name, "model": body.get("model", ""), "displayName": body.get("displayName", ""),
+                     "usageMetadata": {"totalTokenCount": tokens}}
+
+    def delete_cache(self, api_key, name):
+        with self.lock:
+            entry = self.caches.get(name)
+            if entry is None or entry[0] != api_key:
+                return 404, error_body(404, "NOT_FOUND", f"CachedContent not found: {name}")
+            del self.caches[name]
+        self._count("caches_deleted")
+        return 200, {}
+
+    def generate(self, api_key, body):
+        """处理一次 generateContent，返回 (HTTP 状态码, 响应 JSON)。"""
+        self._count("requests")
+        contents = body.get("contents") or []
+        if isinstance(contents, dict):
+            contents = [contents]
+        prompt = "\n".join(content_text(content) for content in contents if content.get("role", "user") == "user")
+        system = content_text(body.get("systemInstruction"))
+        cached_tokens = 0
+        if body.get("cachedContent"):
+            # 缓存属于创建它的 key（项目），其他 key 不能使用
+            with self.lock:
+                entry = self.caches.get(body["cachedContent"])
+            if entry is None or entry[0] != api_key:
+                return 403, error_body(403, "PERMISSION_DENIED", f"CachedContent not found (or permission denied): {body['cachedContent']}")
+            if system:
+                return 400, error_body(400, "INVALID_ARGUMENT", "CachedContent can not be used with GenerateContent request "
+                                                                "setting system_instruction, tools or tool_config.")
+            cached_tokens = entry[2]
+        config = body.get("generationConfig") or {}
+        json_mode = config.get("responseMimeType") == "application/json"
+        items = parse_prompt_items(prompt)
+        self._delay(len(items))
+
+        wait = self._quota_wait(api_key)
+        if wait or self._roll(self.rate_429):
+            self._count("429")
+            return 429, error_body(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota).",
+                                   retry_delay=wait or self.retry_delay)
+        if self._roll(self.rate_503):
+            self._count("503")
+            return 503, error_body(503, "UNAVAILABLE", "The model is overloaded. Please try again later.")
+
+        text = self._reply_lines(items, json_mode)
+        # 与真实 API 一致：promptTokenCount 包含缓存部分，cachedContentTokenCount 单独列出
+        prompt_tokens = count_tokens(system + prompt) + cached_tokens
+        output_tokens = count_tokens(text)
+        self._count("ok")
+        self._count("prompt_tokens", prompt_tokens)
+        self._count("cached_tokens", cached_tokens)
+        self._count("output_tokens", output_tokens)
+        usage = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                 "totalTokenCount": prompt_tokens + output_tokens}
+        if cached_tokens:
+            usage["cachedContentTokenCount"] = cached_tokens
+        return 200, {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": usage,
+        }
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # 保持连接，避免每个请求都重新建立 TCP 连接，影响基准结果
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, code, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=UTF-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                path = self.path.split("?", 1)[0]
+                try:
+                    body = json.loads(raw or b"{}")
+                except ValueError:
+                    self._send(400, error_body(400, "INVALID_ARGUMENT", "Invalid JSON payload"))
+                    return
+                api_key = self.headers.get("x-goog-api-key", "")
+                if _GENERATE_PATH.match(path):
+                    self._send(*mock.generate(api_key, body))
+                elif _CACHES_PATH.match(path):
+                    self._send(*mock.create_cache(api_key, body))
+                else:
+                    self._send(404, error_body(404, "NOT_FOUND", f"Unknown path: {self.path}"))
+
+            def do_DELETE(self):
+                match = _CACHE_PATH.match(self.path.split("?", 1)[0])
+                if not match:
+                    self._send(404, error_body(404, "NOT_FOUND", f"Unknown path: {self.path}"))
+                    return
+                self._send(*mock.delete_cache(self.headers.get("x-goog-api-key", ""), match.group(1)))
+
+        return Handler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="本地 Gemini 替身服务（离线测试 / 基准测试用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_mock_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_mock_arguments(parser):
+    """替身服务的行为参数，benchmark.py 共用。"""
+    parser.add_argument("--latency", type=float, default=0.2, help="每个请求的基础延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的随机浮动范围（秒）")
+    parser.add_argument("--line-latency", type=float, default=0.0, help="每行额外的延迟（秒）")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="随机返回 429 的概率")
+    parser.add_argument("--rate-503", type=float, default=0.0, help="随机返回 503 的概率")
+    parser.add_argument("--retry-delay", type=int, default=1, help="429 中 RetryInfo 的等待秒数")
+    parser.add_argument("--mock-rpm", type=int, default=0, help="每个 key 每分钟的请求配额，0 表示不限")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="回复中每行被省略的概率")
+    parser.add_argument("--garble-rate", type=float, default=0.0, help="回复中每行索引被写错的概率")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024, help="上下文缓存的最小 token 数")
+    parser.add_argument("--seed", type=int, help="随机种子，便于复现")
+
+
+def mock_from_args(args, host="127.0.0.1", port=0):
+    return MockGemini(host=host, port=port, latency=args.latency, jitter=args.jitter, line_latency=args.line_latency,
+                      rate_429=args.rate_429, rate_503=args.rate_503, retry_delay=args.retry_delay, rpm=args.mock_rpm,
+                      drop_rate=args.drop_rate, garble_rate=args.garble_rate, cache_min_tokens=args.cache_min_tokens,
+                      seed=args.seed)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mock = mock_from_args(args, host=args.host, port=args.port)
+    print(f"Gemini 替身服务已启动: {mock.base_url}（Ctrl+C 退出）")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.server.server_close()
+        print(json.dumps(mock.snapshot(), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+字幕文本清洗。
+
+clean_subtitle_text 与 translate.py 原来逐条 re.sub 的规则输出完全一致，
+只是预编译了正则、跳过不可能命中的规则，并把换行/破折号空格/多空格几步合并成一次空白折叠：
+原规则中 "\\n" -> " "、"-\\s+" -> "- "、" -\\s+" -> " - " 的结果都会被最后的 "\\s+" -> " " 覆盖。
+两套实现的对比见 check_normalize.py。
+"""
+import re
+import unicodedata
+
+_BRACKETS = re.compile(r'\[.*?\]')
+_SPEAKER = re.compile(r'^[A-Za-z][A-Za-z\s]*:')
+_FONT_OPEN = re.compile(r'<font[^>]*>')
+_EMPTY_ITALIC = re.compile(r'<i>(?:(?![a-zA-Z0-9]).)*?</i>')
+_SPACES = re.compile(r'\s+')
+
+# ASCII 中既不是标点（Unicode P 类）也不是空白的字符
+_ASCII_LANG_CHARS = frozenset(
+    chr(c) for c in range(128)
+    if not unicodedata.category(chr(c)).startswith('P') and not chr(c).isspace()
+)
+
+
+def clean_subtitle_text(text):
+    # 删除听障文本
+    if '[' in text:
+        text = _BRACKETS.sub('', text)
+    # 删除:前听障文本（人名/机构名字符串）
+    if ':' in text:
+        text = _SPEAKER.sub('', text)
+    # 删除<font <i>文本
+    if '<' in text:
+        text = _FONT_OPEN.sub('', text).replace('</font>', '')
+        text = _EMPTY_ITALIC.sub('', text)
+    # 处理破折号：将 "--" 转换为 "..."
+    if '--' in text:
+        text = text.replace('--', '...')
+    # 换行、破折号后空格和多空格统一折叠成单个空格，再去除首尾空格
+    return _SPACES.sub(' ', text).strip()
+
+
+def has_language_text(text):
+    """
+    检查文本是否包含语言字符（非标点、非空格）。
+    纯 ASCII 文本直接查表，其余字符才用 unicodedata 检查标点类别。
+    """
+    if text.isascii():
+        return not _ASCII_LANG_CHARS.isdisjoint(text)
+    return any(not unicodedata.category(c).startswith('P') and not c.isspace() for c in text)
+
+
+def _normalize_one(text):
+    text = clean_subtitle_text(text)
+    return text if text and has_language_text(text) else None
+
+
+def normalize_texts(texts):
+    """
+    清洗一组字幕文本，没有语言字符的返回 None。
+    单条清洗只需几微秒，进程池传递文本的开销比清洗本身还大，因此始终在当前进程内处理。
+    """
+    return [_normalize_one(t) for t in texts]
@@ -0,0 +1,67 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+class ProbeCache:
+    """
+    磁盘上的 ffprobe 结果缓存（SQLite），以视频的绝对路径为键。
+    记录探测时的文件大小和修改时间，任何一个变化都视为未缓存，重新探测。
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS probe ("
+                " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL,"
+                " streams TEXT NOT NULL, probed REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def file_stat(video_path):
+        try:
+            st = os.stat(video_path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def get(self, video_path):
+        """返回缓存的字幕流列表；没有缓存或文件已变化时返回 None。"""
+        key = os.path.abspath(video_path)
+        stat = self.file_stat(key)
+        if stat is None:
+            return None
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime, streams FROM probe WHERE path = ?", (key,)).fetchone()
+        if row is None or tuple(row[:2]) != stat:
+            return None
+        return json.loads(row[2])
+
+    def missing(self, video_paths):
+        """返回没有有效缓存的视频，供后台预先探测。"""
+        return [v for v in video_paths if self.get(v) is None]
+
+    def put(self, video_path, streams, stat=None):
+        """
+        写入探测结果。stat 应为探测前取得的 (大小, 修改时间)，
+        这样探测期间文件被改写时，下次仍会重新探测。
+        """
+        key = os.path.abspath(video_path)
+        stat = stat or self.file_stat(key)
+        if stat is None:
+            return
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?, ?)",
+                    (key, stat[0], stat[1], json.dumps(streams, ensure_ascii=False), time.time()),
+                )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
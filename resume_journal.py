@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+import threading
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResumeJournal:
+    """
+    断点续传日志（JSON Lines，放在输出文件旁边）。
+    第一行是元信息（源文件哈希、清洗/提示词版本、目标语言等），之后追加：
+      {"i": cue 序号, "t": 译文}   每个已完成的 cue，包括乱序完成、尚未写出的
+      {"w": 已写出的 cue 数, "o": 输出文件字节长度, "n": cue 总数}   每次写出后的检查点
+    续传时只读日志、不再解析输出文件；元信息不一致说明源文件或规则变了，需要重新翻译。
+    日志文件只在任务开始写出结果时才打开，之前完成的 cue 先记在内存里，打开时一并写入。
+    """
+    def __init__(self, path, meta, total=None):
+        self.path = path
+        self.meta = meta
+        self.total = total
+        self.lock = threading.Lock()
+        self.f = None
+        self.pending = []
+
+    @property
+    def is_open(self):
+        return self.f is not None
+
+    @property
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        """
+        读取日志，返回 (results, written, offset)；日志不存在、损坏或元信息不一致时返回 None。
+        """
+        if not self.exists:
+            return None
+        results = {}
+        written, offset = 0, None
+        with open(self.path, "r", encoding="utf-8") as f:
+            first = f.readline()
+            try:
+                if json.loads(first) != self.meta:
+                    return None
+            except ValueError:
+                return None
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # 崩溃时可能留下半行，忽略
+                    continue
+                if "i" in rec:
+                    results[rec["i"]] = rec["t"]
+                elif "w" in rec:
+                    written, offset = rec["w"], rec["o"]
+        if offset is None:
+            return None
+        return results, written, offset
+
+    def start(self, written, offset):
+        """重新开始一份日志，只包含元信息和一个检查点。"""
+        self.compact(written, offset)
+        self.open()
+
+    def open(self):
+        with self.lock:
+            if self.f is None:
+                self.f = open(self.path, "a", encoding="utf-8")
+                self.f.writelines(self.pending)
+                self.pending = []
+
+    def record(self, idx, trans):
+        line = json.dumps({"i": idx, "t": trans or ""}, ensure_ascii=False) + "\n"
+        with self.lock:
+            if self.f is None:
+                self.pending.append(line)
+            else:
+                self.f.write(line)
+
+    def _checkpoint_record(self, written, offset):
+        rec = {"w": written, "o": offset}
+        if self.total is not None:
+            rec["n"] = self.total
+        return json.dumps(rec) + "\n"
+
+    def checkpoint(self, written, offset):
+        with self.lock:
+            self.f.write(self._checkpoint_record(written, offset))
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def compact(self, written, offset):
+        """把日志压缩成元信息 + 最后一个检查点，原子替换。"""
+        with self.lock:
+            reopen = self.f is not None
+            if reopen:
+                self.f.close()
+                self.f = None
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(json.dumps(self.meta, ensure_ascii=False) + "\n")
+                f.write(self._checkpoint_record(written, offset))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            if reopen:
+                self.f = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        with self.lock:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+
+
+def read_progress(path):
+    """
+    不校验元信息，只读取日志最后一个检查点，返回 (已写出的 cue 数, cue 总数)，用于界面显示翻译进度。
+    读取失败时返回 None；旧版本的日志没有记录总数，总数为 None。
+    """
+    progress = None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            f.readline()
+            for line in f:
+                if not line.startswith('{"w"'):
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                progress = (rec["w"], rec.get("n"))
+    except OSError:
+        return None
+    return progress
@@ -0,0 +1,101 @@
+import re
+import codecs
+
+_TIMING = re.compile(
+    r'(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})\s*-->\s*(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})'
+)
+
+_BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+class Cue:
+    """一条字幕，时间以毫秒整数保存。"""
+    __slots__ = ("index", "start", "end", "text")
+
+    def __init__(self, index, start, end, text):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.text = text
+
+
+def detect_encoding(path):
+    """
+    识别字幕文件编码：先看 BOM，再流式校验整个文件是否为 UTF-8，
+    都不是时交给 charset_normalizer / chardet（如已安装），最后退回 latin-1（不会解码失败）。
+    """
+    with open(path, "rb") as f:
+        head = f.read(4)
+        for bom, encoding in _BOMS:
+            if head.startswith(bom):
+                return encoding
+        f.seek(0)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        try:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                decoder.decode(chunk)
+            decoder.decode(b"", final=True)
+            return "utf-8"
+        except UnicodeDecodeError:
+            pass
+
+    try:
+        from charset_normalizer import from_path
+        best = from_path(path).best()
+        if best and best.encoding:
+            return best.encoding
+    except ImportError:
+        pass
+    try:
+        import chardet
+        with open(path, "rb") as f:
+            guess = chardet.detect(f.read(1 << 16))
+        if guess.get("encoding"):
+            return guess["encoding"]
+    except ImportError:
+        pass
+    return "latin-1"
+
+
+def _to_ms(h, m, s, ms):
+    return ((int(h) * 60 + int(m)) * 60 + int(s)) * 1000 + int(ms)
+
+
+def _parse_block(lines):
+    # 时间轴一般在第 1 行（无序号）或第 2 行（序号之后）
+    for pos in range(min(2, len(lines))):
+        m = _TIMING.search(lines[pos])
+        if m:
+            break
+    else:
+        return None
+    index = None
+    if pos == 1 and lines[0].strip().isdigit():
+        index = int(lines[0].strip())
+    g = m.groups()
+    return Cue(index, _to_ms(*g[:4]), _to_ms(*g[4:]), "\n".join(lines[pos + 1:]))
+
+
+def iter_cues(path, encoding=None):
+    """逐条读取 SRT 字幕，不一次性载入整个文件。encoding 为空时自动识别。"""
+    if encoding is None:
+        encoding = detect_encoding(path)
+    with open(path, "r", encoding=encoding, errors="replace") as f:
+        block = []
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line.strip():
+                block.append(line)
+            elif block:
+                cue = _parse_block(block)
+                if cue:
+                    yield cue
+                block = []
+        if block:
+            cue = _parse_block(block)
+            if cue:
+                yield cue
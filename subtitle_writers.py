@@ -0,0 +1,152 @@
+import os
+import re
+
+
+def ms_to_ass_time(ms):
+    hours, rest = divmod(ms, 3600000)
+    minutes, rest = divmod(rest, 60000)
+    seconds, millis = divmod(rest, 1000)
+    return f"{hours}:{minutes:02}:{seconds:02}.{millis // 10:02}"
+
+
+def ms_to_srt_time(ms, sep=","):
+    hours, rest = divmod(ms, 3600000)
+    minutes, rest = divmod(rest, 60000)
+    seconds, millis = divmod(rest, 1000)
+    return f"{hours:02}:{minutes:02}:{seconds:02}{sep}{millis:03}"
+
+
+class SubtitleWriter:
+    """
+    字幕输出的基类。整个任务只打开一次文件，字幕先进入写缓冲，
+    checkpoint 时才刷新并 fsync，返回当前字节长度供续传日志记录。
+    子类提供 header() 和 format_cue()。
+    """
+    def __init__(self, path, buffer_size=1 << 16):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.f = None
+
+    def header(self):
+        return ""
+
+    def format_cue(self, start_ms, end_ms, orig, trans):
+        raise NotImplementedError
+
+    def open(self, offset=None):
+        """offset 为空时新建文件并写入头部，否则截断到 offset 后继续追加。"""
+        if offset is None:
+            self.f = open(self.path, "wb", buffering=self.buffer_size)
+            self.f.write(self.header().encode("utf-8"))
+        else:
+            self.f = open(self.path, "rb+", buffering=self.buffer_size)
+            self.f.truncate(offset)
+            self.f.seek(offset)
+            self.resumed()
+
+    def resumed(self):
+        """续传打开后调用，需要从已有内容恢复状态的格式（如 SRT 序号）在这里处理。"""
+
+    def write(self, start_ms, end_ms, orig, trans):
+        self.f.write(self.format_cue(start_ms, end_ms, orig, trans).encode("utf-8"))
+
+    def checkpoint(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+class AssWriter(SubtitleWriter):
+    """
+    ASS 输出。bilingual 为 True 时原文在上、译文在下，译文前的标记 {r<trans_style>} 与之前生成的文件保持一致；
+    否则只写译文。header 为 [Script Info]/[V4+ Styles]/[Events] 头部，style 为 Dialogue 使用的样式名。
+    """
+    def __init__(self, path, header, style="Default", trans_style="Eng", bilingual=True, buffer_size=1 << 16):
+        super().__init__(path, buffer_size=buffer_size)
+        self.ass_header = header
+        self.style = style
+        self.trans_style = trans_style
+        self.bilingual = bilingual
+
+    def header(self):
+        return self.ass_header
+
+    def format_cue(self, start_ms, end_ms, orig, trans):
+        text = f"{orig}\\N{{r{self.trans_style}}}{trans}" if self.bilingual else trans
+        return f"Dialogue: 0,{ms_to_ass_time(start_ms)},{ms_to_ass_time(end_ms)},{self.style},,0,0,0,,{text}\n"
+
+
+class SrtWriter(SubtitleWriter):
+    """SRT 输出，bilingual 为 True 时原文和译文各占一行。序号按实际写出的条数连续编号。"""
+    def __init__(self, path, bilingual=True, buffer_size=1 << 16):
+        super().__init__(path, buffer_size=buffer_size)
+        self.bilingual = bilingual
+        self.count = 0
+
+    def resumed(self):
+        # 序号没有记在续传日志里，从截断后的文件中数出已写的条数
+        self.f.seek(0)
+        self.count = sum(1 for line in self.f if b"-->" in line)
+        self.f.seek(0, os.SEEK_END)
+
+    def format_cue(self, start_ms, end_ms, orig, trans):
+        self.count += 1
+        text = f"{orig}\n{trans}" if self.bilingual else trans
+        return f"{self.count}\n{ms_to_srt_time(start_ms)} --> {ms_to_srt_time(end_ms)}\n{text}\n\n"
+
+
+_VTT_ESCAPES = re.compile(r"&|<(?!/?[ibu]>)|-->")
+
+
+class VttWriter(SubtitleWriter):
+    """WebVTT 输出，bilingual 为 True 时原文和译文各占一行。保留 <i>/<b>/<u> 标签，其余 & 和 < 转义。"""
+    def __init__(self, path, bilingual=True, buffer_size=1 << 16):
+        super().__init__(path, buffer_size=buffer_size)
+        self.bilingual = bilingual
+
+    def header(self):
+        return "WEBVTT\n\n"
+
+    @staticmethod
+    def escape(text):
+        return _VTT_ESCAPES.sub(lambda m: {"&": "&amp;", "<": "&lt;", "-->": "--&gt;"}[m.group()], text)
+
+    def format_cue(self, start_ms, end_ms, orig, trans):
+        text = f"{self.escape(orig)}\n{self.escape(trans)}" if self.bilingual else self.escape(trans)
+        return f"{ms_to_srt_time(start_ms, '.')} --> {ms_to_srt_time(end_ms, '.')}\n{text}\n\n"
+
+
+# 输出格式 -> (文件后缀, 构造函数)。构造函数参数为 (输出路径, ASS 头部)
+OUTPUT_FORMATS = {
+    "ass": (".Dex7er.EN.CN.ass", lambda path, ass_header: AssWriter(path, ass_header)),
+    "ass-mono": (".Dex7er.CN.ass", lambda path, ass_header: AssWriter(path, ass_header, bilingual=False)),
+    "srt": (".Dex7er.EN.CN.srt", lambda path, ass_header: SrtWriter(path)),
+    "srt-mono": (".Dex7er.CN.srt", lambda path, ass_header: SrtWriter(path, bilingual=False)),
+    "vtt": (".Dex7er.EN.CN.vtt", lambda path, ass_header: VttWriter(path)),
+    "vtt-mono": (".Dex7er.CN.vtt", lambda path, ass_header: VttWriter(path, bilingual=False)),
+}
+
+
+def is_output_file(path):
+    """判断是否为本工具生成的字幕，扫描 SRT 时据此跳过，避免把译文当作原文再翻译。"""
+    name = os.path.basename(path)
+    return any(name.endswith(suffix) for suffix, _ in OUTPUT_FORMATS.values())
+
+
+def make_writers(base, formats, ass_header):
+    """
+    为 base（不含扩展名的源文件路径）创建一组输出，返回 {格式: writer}。
+    同一轮翻译的结果同时写入所有格式，不需要为另一种格式重复调用 API。
+    """
+    writers = {}
+    for fmt in formats:
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的输出格式: {fmt}（可选: {', '.join(OUTPUT_FORMATS)}）")
+        suffix, factory = OUTPUT_FORMATS[fmt]
+        writers[fmt] = factory(base + suffix, ass_header)
+    return writers
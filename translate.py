@@ -4,36 +4,165 @@ import sys
 import re
 import time
 import json
-import pysrt
+import asyncio
 import threading
-import unicodedata
+import functools
+from array import array
+from collections import deque, OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from google import genai
+from google.genai import types
+from keypool import KeyPool
+from translation_memory import TranslationMemory
+from resume_journal import ResumeJournal, file_sha256
+from normalize import normalize_texts
+from srt_reader import iter_cues
+from subtitle_writers import make_writers
+from context_cache import PromptContext
+from app_paths import data_path
+import metrics
+from metrics import METRICS, format_summary
 
 MODEL = "gemini-2.5-flash"
 BATCH_SIZE = 20
+# 字幕清洗规则和提示词的版本号，修改规则后递增，旧的续传日志随之失效
+CLEAN_VERSION = 1
+PROMPT_VERSION = 2
+# 读取字幕时每攒够这么多条清洗一次
+CLEAN_CHUNK_SIZE = 2000
+# 输出文件落盘并写入续传检查点的最短间隔（秒）；期间的译文已记在续传日志里
+CHECKPOINT_INTERVAL = 5.0
+# 同时打开输出文件和续传日志的任务数上限，超过时关闭最久没有写出的任务的文件，避免选中大量文件时耗尽文件句柄
+MAX_OPEN_JOBS = 64
+# 默认输出格式，可选值见 subtitle_writers.OUTPUT_FORMATS（ass、ass-mono、srt、srt-mono、vtt、vtt-mono）
+FORMATS = ["ass"]
+# 自适应批大小的上下限，以及每批原文的输入 token 预算（不含固定提示词）
+MIN_BATCH_SIZE = 5
+MAX_BATCH_SIZE = 80
+BATCH_TOKEN_BUDGET = 1500
+# 平滑后的缺失索引比例超过该值、且当批缺失不止一行时缩小批次，低于其一半时逐步放大
+MISSING_RATE_SHRINK = 0.1
+# 缺失比例指数加权平均的权重（越大越看重最近的批次）
+MISSING_RATE_SMOOTHING = 0.3
+# 缩小批次后观察这么多批；缺失比例没有降到一半以下（缺失与批大小无关）时恢复原大小，并以它为下限
+SHRINK_CHECK_BATCHES = 4
+# 补译缺失行时，每个缺失行前后各附带的上下文行数
+REPAIR_CONTEXT = 2
+# 结构化输出：要求 Gemini 按 JSON schema 返回 [{"index": n, "text": "..."}]，代替 index|||text 文本
+JSON_MODE = False
+JSON_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "index": {"type": "INTEGER"},
+            "text": {"type": "STRING"},
+        },
+        "required": ["index", "text"],
+    },
+}
+# 固定提示词作为 system instruction 发送；CONTEXT_CACHE 为 True 时在每个 key 上注册一次显式上下文缓存，
+# 整次运行的批次共用。缓存有最小 token 数要求（CACHE_MIN_TOKENS），固定提示词较短时只用 system instruction
+CONTEXT_CACHE = True
+CACHE_TTL = 3600
+CACHE_MIN_TOKENS = 1024
+# 术语表文件（JSON 对象，{"原文": "译名"}），存在时自动加入固定提示词
+GLOSSARY_FILE = data_path("glossary.json")
 RETRY = 3
 SLEEP_ON_RETRY = 2
 MAX_WORKERS = 2
+# 每个 API key 同时在途的请求数
+PER_KEY_CONCURRENCY = 4
+# 每个 API key 的每分钟请求数 / 输入 token 数上限，0 表示不在客户端限速，只靠 429 后的冷却（免费层可设为 10 / 250000）
+KEY_RPM = 0
+KEY_TPM = 0
+# 每个 API key 每天的请求数上限，只用于 dry-run 估算需要的天数，0 表示不限制（免费层为 250）
+KEY_RPD = 0
+# dry-run 估算输出 token 时，译文相对原文（含索引）的 token 比例
+OUTPUT_TOKEN_RATIO = 1.0
+# 同一个 key 连续失败 RETRY 次后的冷却时间（秒），以及 503 后的冷却时间
+KEY_COOLDOWN = 30
+UNAVAILABLE_COOLDOWN = 10
+# 翻译记忆（SQLite）文件和最大条目数，TM_FILE 为空表示不使用
+TM_FILE = data_path("translation_memory.db")
+TM_MAX_ENTRIES = 200000
+# 默认翻译后端：thread（线程池 + 同步客户端）或 async（asyncio + 异步客户端）
+BACKEND = "thread"
+# Gemini API 地址，为空时使用官方地址；指向本地 mock_gemini.py 可以离线测试和跑基准
+BASE_URL = ""
 
-thread_local = threading.local()
+# 未显式传入 API key 时读取的文件（JSON 字符串数组），只在第一次真正需要 key 时读取
+KEYS_FILE = os.path.join(os.path.dirname(__file__), "api_keys.json")
 
-keys_file = os.path.join(os.path.dirname(__file__), "api_keys.json")
-if os.path.exists(keys_file):
-    with open(keys_file, "r", encoding="utf-8") as f:
-        API_KEYS = json.load(f)
-else:
-    raise Exception("未找到 api_keys.json 文件")
-if not API_KEYS:
-    raise Exception("api_keys.json 中没有有效 API Key")
+_key_pools = {}
+_default_keys = None
+_memory = None
+_clients = {}
+_shared_lock = threading.Lock()
 
-def init_thread_local():
-    thread_local.current_api_index = 0
+def load_api_keys(path=None):
+    """读取 API key 文件，去掉空白和重复的 key。"""
+    path = path or KEYS_FILE
+    if not os.path.exists(path):
+        raise Exception(f"未找到 API Key 文件: {path}")
+    with open(path, "r", encoding="utf-8") as f:
+        keys = json.load(f)
+    keys = list(dict.fromkeys(k.strip() for k in keys if isinstance(k, str) and k.strip()))
+    if not keys:
+        raise Exception(f"{os.path.basename(path)} 中没有有效 API Key")
+    return keys
 
-def get_client():
-    if not hasattr(thread_local, "client"):
-        thread_local.client = genai.Client(api_key=API_KEYS[thread_local.current_api_index])
-    return thread_local.client
+def get_key_pool(api_keys=None):
+    """
+    进程内共享的 key 池，所有线程和协程从这里取 key；同一组 key 始终得到同一个池。
+    api_keys 为空时使用 KEYS_FILE 中的 key。
+    """
+    global _default_keys
+    if api_keys is None:
+        with _shared_lock:
+            if _default_keys is None:
+                _default_keys = load_api_keys()
+            api_keys = _default_keys
+    keys = tuple(dict.fromkeys(k.strip() for k in api_keys if k and k.strip()))
+    if not keys:
+        raise Exception("没有有效 API Key")
+    with _shared_lock:
+        pool = _key_pools.get(keys)
+        if pool is None:
+            pool = _key_pools[keys] = KeyPool(list(keys), rpm=KEY_RPM, tpm=KEY_TPM, max_in_flight=PER_KEY_CONCURRENCY)
+        return pool
+
+def load_glossary(path=None):
+    """读取术语表（JSON 对象，原文 -> 译名）；未指定 path 且 GLOSSARY_FILE 不存在时返回空字典。"""
+    if path is None:
+        path = GLOSSARY_FILE
+        if not path or not os.path.exists(path):
+            return {}
+    with open(path, "r", encoding="utf-8") as f:
+        glossary = json.load(f)
+    if not isinstance(glossary, dict):
+        raise Exception(f"{os.path.basename(path)} 应为 JSON 对象（原文: 译名）")
+    return {str(k).strip(): str(v).strip() for k, v in glossary.items() if str(k).strip() and str(v).strip()}
+
+def get_translation_memory():
+    """进程内共享的翻译记忆，未配置 TM_FILE 时返回 None。"""
+    global _memory
+    with _shared_lock:
+        if _memory is None and TM_FILE:
+            _memory = TranslationMemory(TM_FILE, max_entries=TM_MAX_ENTRIES)
+        return _memory
+
+def new_client(api_key):
+    http_options = types.HttpOptions(base_url=BASE_URL) if BASE_URL else None
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+def get_client(api_key):
+    with _shared_lock:
+        # BASE_URL 可能在运行中被修改（如基准测试），按地址区分缓存的客户端
+        client_key = (BASE_URL, api_key)
+        if client_key not in _clients:
+            _clients[client_key] = new_client(api_key)
+        return _clients[client_key]
 
 ASS_HEADER = """[Script Info]
 ; This is an Advanced Sub Station Alpha v4+ script.
@@ -51,85 +180,172 @@ Style: Eng,微软雅黑,22,&H00FFFFFF,&H0000FFFF,&H00000000,&H00000000,0,0,0,0,1
 Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
 """
 
-def srt_time_to_ass(srt_time):
-    return f"{srt_time.hours}:{srt_time.minutes:02}:{srt_time.seconds:02}.{int(srt_time.milliseconds/10):02}"
-
-def parse_existing_ass(ass_file):
+def parse_existing_ass(ass_file, truncate=True):
     if not os.path.exists(ass_file):
         return 0
+    if truncate:
+        truncate_partial_line(ass_file)
     with open(ass_file, "r", encoding="utf-8") as f:
         return sum(1 for line in f if line.startswith("Dialogue:"))
 
-def safe_call_generate(prompt, log=None, stop_flag=None):
+def truncate_partial_line(path):
+    # 写入中途崩溃可能留下半行，截掉最后一个换行符之后的内容，保证文件只包含完整的已完成前缀
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        pos = size
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            nl = chunk.rfind(b"\n")
+            if nl != -1:
+                pos = pos - step + nl + 1
+                break
+            pos -= step
+        if pos < size:
+            f.truncate(pos)
+
+def parse_retry_delay(err_info, default=5):
+    # 尝试解析 RetryInfo.retryDelay（秒），多等 1 秒留出余量
+    retry_delay = default
+    try:
+        details = err_info.get('details', [])
+        for d in details:
+            if d.get('@type', '').endswith('RetryInfo'):
+                delay_str = d.get('retryDelay', '5s')
+                # 解析秒数
+                m = re.search(r'(\d+)', delay_str)
+                if m:
+                    retry_delay = int(m.group(1)) + 1
+    except Exception:
+        pass
+    return retry_delay
+
+def api_error_info(e):
+    # 兼容 e.error 和 genai APIError.details 两种错误结构
+    if hasattr(e, 'error') and isinstance(e.error, dict):
+        return e.error
+    details = getattr(e, 'details', None)
+    if isinstance(details, dict):
+        return details.get('error', details)
+    return {}
+
+def estimate_tokens(text):
+    # 粗略估算：ASCII 约 4 字符 1 个 token，其他字符（中日韩等）约 1 字符 1 个 token
+    ascii_count = len(text.encode("ascii", "ignore"))
+    return ascii_count // 4 + (len(text) - ascii_count) + 1
+
+def handle_api_error(pool, state, e, log):
+    """
+    根据错误类型更新 key 的健康状态，返回本次重试前需要等待的秒数。
+    429 和 503 只让出错的 key 冷却，请求立即交给其他 key。
+    """
+    info = api_error_info(e)
+    code = info.get('code') or getattr(e, 'code', None)
+    msg = str(e)
+
+    if code == 429:
+        METRICS.inc("retries", "429")
+        retry_delay = parse_retry_delay(info)
+        pool.cooldown(state, retry_delay)
+        log(f"⏳ API key {state.label} 遇到 429 限流，冷却 {retry_delay}s，改用其他 key 重试...")
+        return 0
+
+    if code == 503 or '503' in msg or 'Service Unavailable' in msg:
+        METRICS.inc("retries", "503")
+        pool.cooldown(state, UNAVAILABLE_COOLDOWN)
+        log(f"⚠️ API key {state.label} 遇到 503，立即切换 API key...")
+        return 0
+
+    if code in (401, 403) or 'API_KEY_INVALID' in msg or 'API key not valid' in msg:
+        METRICS.inc("retries", "auth")
+        pool.disable(state)
+        log(f"❌ API key {state.label} 无效，已停用")
+        return 0
+
+    # 普通错误：同一个 key 连续失败 RETRY 次后冷却一段时间
+    METRICS.inc("retries", "other")
+    if pool.record_failure(state) >= RETRY:
+        pool.cooldown(state, KEY_COOLDOWN)
+        log(f"⚠️ API key {state.label} 连续失败 {RETRY} 次，冷却 {KEY_COOLDOWN}s")
+    return SLEEP_ON_RETRY
+
+def record_usage(resp):
+    """把回复中的 usage_metadata 记入 token 计数：输入、输出、思考和命中上下文缓存的部分。"""
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is None:
+        return
+    METRICS.inc("tokens", "input", usage.prompt_token_count or 0)
+    METRICS.inc("tokens", "output", usage.candidates_token_count or 0)
+    METRICS.inc("tokens", "thinking", getattr(usage, "thoughts_token_count", None) or 0)
+    METRICS.inc("tokens", "cached", getattr(usage, "cached_content_token_count", None) or 0)
+
+def json_config_options(json_mode=False):
+    return {"response_mime_type": "application/json", "response_schema": JSON_RESPONSE_SCHEMA} if json_mode else {}
+
+def make_prompt_context(target_lang="Chinese", json_mode=False, glossary=None, show_context=None, use_cache=False, log=None):
+    """
+    创建一次运行共用的 PromptContext。固定提示词不足 CACHE_MIN_TOKENS 时不创建显式缓存，
+    只作为 system instruction 发送（模型对较长的相同前缀也会自动缓存）。
+    """
+    if log is None:
+        log = print
+    system_instruction = build_system_instruction(target_lang, json_mode=json_mode, glossary=glossary, show_context=show_context)
+    tokens = estimate_tokens(system_instruction)
+    if use_cache and tokens < CACHE_MIN_TOKENS:
+        log(f"固定提示词约 {tokens} token，不足 {CACHE_MIN_TOKENS}，不创建上下文缓存")
+        use_cache = False
+    return PromptContext(MODEL, system_instruction, tokens, json_config=json_config_options(json_mode), use_cache=use_cache,
+                         ttl=CACHE_TTL, log=log)
+
+def safe_call_generate(prompt, log=None, stop_flag=None, pool=None, prompt_context=None):
+    """
+    同步调用 Gemini。prompt_context 提供固定提示词（system instruction 或上下文缓存）和 JSON 输出配置，
+    按实际分到的 key 生成请求配置。
+    """
     if log is None:
         log = print
+    if pool is None:
+        pool = get_key_pool()
 
+    tokens = estimate_tokens(prompt) + (prompt_context.tokens if prompt_context else 0)
+    max_attempts = RETRY * len(pool.states)
     attempts = 0
-    last_e = None
+    last_key = None
 
     while True:
         if stop_flag and stop_flag():
             log("⚠️ API 请求被停止")
             return None
+        with METRICS.timer("key_wait"):
+            state = pool.acquire(tokens, stop_flag=stop_flag)
+        if state is None:
+            log("⚠️ API 请求被停止")
+            return None
+        if last_key is not None and state.key != last_key:
+            METRICS.inc("key_rotations")
+        last_key = state.key
         try:
-            resp = get_client().models.generate_content(model=MODEL, contents=prompt)
-            return resp.text
+            client = get_client(state.key)
+            config = prompt_context.config(state.key, client) if prompt_context else None
+            with METRICS.timer("api"):
+                resp = client.models.generate_content(model=MODEL, contents=prompt, config=config)
         except Exception as e:
-            last_e = e
+            pool.release(state, ok=False)
+            METRICS.inc("requests", "error")
             attempts += 1
-            msg = str(e)
-            log(f"⚠️ API 请求失败 (尝试 {attempts}/{RETRY})，错误: {msg}")
-
-            # 处理 429 逻辑
-            if hasattr(e, 'error') and isinstance(e.error, dict):
-                err_info = e.error
-                if err_info.get('code') == 429:
-                    # 尝试解析 retryDelay
-                    retry_delay = 5
-                    try:
-                        details = err_info.get('details', [])
-                        for d in details:
-                            if d.get('@type', '').endswith('RetryInfo'):
-                                delay_str = d.get('retryDelay', '5s')
-                                # 解析秒数
-                                m = re.search(r'(\d+)', delay_str)
-                                if m:
-                                    retry_delay = int(m.group(1)) + 1
-                    except Exception:
-                        pass
-                    log(f"⏳ 遇到 429 限流，等待 {retry_delay}s 后重试...")
-                    time.sleep(retry_delay)
-                    if attempts >= RETRY:
-                        # 超过重试次数切换 key
-                        thread_local.current_api_index += 1
-                        if thread_local.current_api_index >= len(API_KEYS):
-                            raise Exception("所有 API key 已用尽") from last_e
-                        log(f"线程 {threading.current_thread().name} 切换 API key: {API_KEYS[thread_local.current_api_index][:4]}...")
-                        thread_local.client = genai.Client(api_key=API_KEYS[thread_local.current_api_index])
-                        attempts = 0
-                    continue
-
-            # 处理 503 或其他严重错误
-            if '503' in msg or 'Service Unavailable' in msg:
-                log("⚠️ 遇到 503，立即切换 API key...")
-                thread_local.current_api_index += 1
-                if thread_local.current_api_index >= len(API_KEYS):
-                    raise Exception("所有 API key 已用尽") from last_e
-                thread_local.client = genai.Client(api_key=API_KEYS[thread_local.current_api_index])
-                attempts = 0
-                continue
-
-            # 普通错误重试
-            if attempts < RETRY:
-                time.sleep(SLEEP_ON_RETRY)
-            else:
-                # 超过 RETRY 次失败后切换 key
-                thread_local.current_api_index += 1
-                if thread_local.current_api_index >= len(API_KEYS):
-                    raise Exception("所有 API key 已用尽") from last_e
-                log(f"线程 {threading.current_thread().name} 切换 API key: {API_KEYS[thread_local.current_api_index][:4]}...")
-                thread_local.client = genai.Client(api_key=API_KEYS[thread_local.current_api_index])
-                attempts = 0
+            log(f"⚠️ API 请求失败 (尝试 {attempts}/{max_attempts})，错误: {e}")
+            if attempts >= max_attempts:
+                raise Exception("API 请求多次失败，已放弃") from e
+            delay = handle_api_error(pool, state, e, log)
+            if delay:
+                time.sleep(delay)
+            continue
+        pool.release(state)
+        METRICS.inc("requests", "ok")
+        record_usage(resp)
+        return resp.text
 
 
 def parse_indexed_response(resp_text):
@@ -156,158 +372,922 @@ def parse_indexed_response(resp_text):
         mapping[idx] = trans
     return mapping
 
-def translate_batch_with_index(texts, batch_start_index, target_lang="Chinese", log=None, stop_flag=None):
+def translate_batch_with_index(texts, batch_start_index, target_lang="Chinese", log=None, stop_flag=None, json_mode=JSON_MODE,
+                               prompt_context=None):
+    if log is None:
+        log = print
     if stop_flag and stop_flag():
         log("⚠️ 批量翻译被停止")
         return [None] * len(texts)
-    if log is None:
-        log = print
-    numbered_inputs = [f"{batch_start_index+i}|||{t}" for i, t in enumerate(texts)]
-
-    prompt = (
-        f"You are a professional translator. Translate the following subtitle lines into {target_lang}.\n"
-        "Each input is prefixed with an index and '|||'. Long sentences may be split across multiple consecutive lines for subtitle timing.\n"
-        "REPLY WITH EXACTLY ONE BLOCK PER INPUT (N inputs = N output blocks), NO EXTRA TEXT OR LINES.\n"
-        "Format: index|||translated_line1\\ntranslated_line2\\n... (exactly matching the input's line count per block).\n"
-        "CRITICAL RULES:\n"
-        "- Allow splitting the translation to adapt to the exact number of input lines (e.g., 4 input lines = 4 translated lines).\n"
-        "- Use natural sentence breaks, punctuation, or pauses to split, keeping each line's length and rhythm similar to the input.\n"
-        "- DO NOT advance, delay, or move any translation forward/backward: maintain strict 1:1 correspondence—line 1 translates line 1, line 2 translates line 2, etc.\n"
-        "- Do not merge, add, or reorder lines; the full sentence must be distributed sequentially across the exact same number of lines.\n"
-        "Do not change indexes. If untranslatable, return index||| (empty for single line) or index|||\\n\\n... (matching line count).\n"
-        "Example:\n"
-        "Input:\n"
-        "1|||This is a very long sentence that \n"
-        "2|||needs to be split for\n"
-        "3|||timing and It continues\n"
-        "4|||here with more details.\n"
-        "Output:\n"
-        "1|||这是一个很长的句子\n"
-        "2|||需要为了时间\n"
-        "3|||而拆分 在这里继续\n"
-        "4|||带有更多细节。\n"
-        "(Note: Exactly 4 lines, split to match input structure; no advancing/delaying—each line corresponds sequentially without reordering.)\n"
-        "IMPORTANT: Consistent translation for names/places (e.g., 'Jack' always '杰克').\n\n"
-        + "\n".join(numbered_inputs)
-    )
+    prompt_context = prompt_context or make_prompt_context(target_lang, json_mode=json_mode, log=log)
+    METRICS.inc("calls", "batch")
+    with METRICS.timer("prompt"):
+        prompt = build_batch_prompt(texts, batch_start_index, json_mode=json_mode)
+    resp_text = safe_call_generate(prompt, log=log, stop_flag=stop_flag, prompt_context=prompt_context)
+    return map_batch_response(resp_text, batch_start_index, len(texts), json_mode=json_mode)
 
-    resp_text = safe_call_generate(prompt, log=log, stop_flag=stop_flag)
-    mapping = parse_indexed_response(resp_text)
+def build_system_instruction(target_lang="Chinese", json_mode=False, glossary=None, show_context=None):
+    """
+    所有请求共用的固定提示词：翻译规则、示例，以及可选的术语表和剧情背景。
+    作为 system instruction 发送或注册为上下文缓存，每批只需发送编号后的原文。
+    """
+    if json_mode:
+        text = (
+            f"You are a professional translator. Translate the \"text\" of every subtitle line you receive into {target_lang}.\n"
+            "Each user message is a JSON array of {\"index\": <n>, \"text\": <line>} objects. "
+            "Long sentences may be split across multiple consecutive lines for subtitle timing.\n"
+            "Reply with a JSON array containing exactly one object {\"index\": <input index>, \"text\": <translation>} per input, in input order.\n"
+            "CRITICAL RULES:\n"
+            "- Keep strict 1:1 correspondence: each object translates only its own input line; do not merge, move, add or reorder content.\n"
+            "- Split a long sentence's translation across the same lines as the input, at natural breaks, keeping each line's length and rhythm similar.\n"
+            "- Do not change indexes. If a line is untranslatable, return its index with an empty text.\n"
+            "IMPORTANT: Consistent translation for names/places (e.g., 'Jack' always '杰克').\n"
+        )
+    else:
+        text = (
+            f"You are a professional translator. Translate the subtitle lines in each user message into {target_lang}.\n"
+            "Each input is prefixed with an index and '|||'. Long sentences may be split across multiple consecutive lines for subtitle timing.\n"
+            "REPLY WITH EXACTLY ONE BLOCK PER INPUT (N inputs = N output blocks), NO EXTRA TEXT OR LINES.\n"
+            "Format: index|||translated_line1\\ntranslated_line2\\n... (exactly matching the input's line count per block).\n"
+            "CRITICAL RULES:\n"
+            "- Allow splitting the translation to adapt to the exact number of input lines (e.g., 4 input lines = 4 translated lines).\n"
+            "- Use natural sentence breaks, punctuation, or pauses to split, keeping each line's length and rhythm similar to the input.\n"
+            "- DO NOT advance, delay, or move any translation forward/backward: maintain strict 1:1 correspondence—line 1 translates line 1, line 2 translates line 2, etc.\n"
+            "- Do not merge, add, or reorder lines; the full sentence must be distributed sequentially across the exact same number of lines.\n"
+            "Do not change indexes. If untranslatable, return index||| (empty for single line) or index|||\\n\\n... (matching line count).\n"
+            "Example:\n"
+            "Input:\n"
+            "1|||This is a very long sentence that \n"
+            "2|||needs to be split for\n"
+            "3|||timing and It continues\n"
+            "4|||here with more details.\n"
+            "Output:\n"
+            "1|||这是一个很长的句子\n"
+            "2|||需要为了时间\n"
+            "3|||而拆分 在这里继续\n"
+            "4|||带有更多细节。\n"
+            "(Note: Exactly 4 lines, split to match input structure; no advancing/delaying—each line corresponds sequentially without reordering.)\n"
+            "IMPORTANT: Consistent translation for names/places (e.g., 'Jack' always '杰克').\n"
+        )
+    if glossary:
+        text += "\nGlossary - always translate these terms exactly as given:\n"
+        text += "".join(f"- {source} => {target}\n" for source, target in glossary.items())
+    if show_context and show_context.strip():
+        text += "\nShow context (background for names, tone and terminology; never translate or output it):\n"
+        text += show_context.strip() + "\n"
+    return text
+
+def build_batch_prompt(texts, batch_start_index, json_mode=False):
+    """每批发送的内容：编号后的原文。翻译规则在 build_system_instruction 中，不随每批重复发送。"""
+    if json_mode:
+        return json.dumps([{"index": batch_start_index + i, "text": t} for i, t in enumerate(texts)], ensure_ascii=False)
+    return "\n".join(f"{batch_start_index + i}|||{t}" for i, t in enumerate(texts))
+
+def parse_json_response(resp_text):
+    """
+    解析结构化输出 [{"index": n, "text": "..."}]，返回 {index: text}。
+    不是合法 JSON 数组时返回 None，由调用方回退到文本解析。
+    """
+    if not resp_text:
+        return {}
+    text = resp_text.strip()
+    if text.startswith("```"):
+        text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text)
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(data, list):
+        return None
+    mapping = {}
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        idx, trans = item.get("index"), item.get("text")
+        if isinstance(idx, str) and idx.strip().isdigit():
+            idx = int(idx)
+        if isinstance(idx, int) and isinstance(trans, str):
+            mapping[idx] = trans
+    return mapping
+
+def map_batch_response(resp_text, batch_start_index, count, json_mode=False):
+    with METRICS.timer("response"):
+        mapping = parse_json_response(resp_text) if json_mode else None
+        if mapping is None:
+            mapping = parse_indexed_response(resp_text)
     results = []
-    for i in range(len(texts)):
+    for i in range(count):
         idx = batch_start_index + i
         trans = mapping.get(idx)
         results.append(trans.replace("\n"," ").strip() if trans else None)
     return results
 
-def translate_line_single(text, log=None, stop_flag=None):
+def translate_line_single(text, target_lang="Chinese", log=None, stop_flag=None, json_mode=JSON_MODE, prompt_context=None):
+    if log is None:
+        log = print
     if stop_flag and stop_flag():
         log("⚠️ 单行翻译被停止")
         return None
+    prompt_context = prompt_context or make_prompt_context(target_lang, json_mode=json_mode, log=log)
+    METRICS.inc("calls", "single")
+    with METRICS.timer("prompt"):
+        prompt = build_batch_prompt([text], 1, json_mode=json_mode)
+    resp = safe_call_generate(prompt, log=log, stop_flag=stop_flag, prompt_context=prompt_context)
+    return map_single_response(resp, json_mode=json_mode)
+
+def map_single_response(resp_text, json_mode=False):
+    """
+    单行请求与批量共用固定提示词（编号为 1 的一行）；回复没有编号时把整段回复当作译文。
+    分隔符写错的回复（如 1||译文）先去掉开头的编号，避免把编号写进字幕。
+    """
+    trans = map_batch_response(resp_text, 1, 1, json_mode=json_mode)[0]
+    if trans is None and resp_text and "|||" not in resp_text and not json_mode:
+        trans = re.sub(r'^\s*\d+\s*\|+', '', resp_text.strip()).strip().replace("\n", " ") or None
+    return trans
+
+def build_repair_prompt(items, target_lang="Chinese", json_mode=False):
+    """
+    items 为 (index, text, 是否需要翻译) 列表，按原文顺序排列。
+    需要翻译的行带 index|||，其余行只作为上下文，以 [context] 标记。
+    通用的翻译规则、术语表和剧情背景在 system instruction 中，这里只说明补译的特殊要求。
+    """
+    lines = [f"{idx}|||{text}" if wanted else f"[context] {text}" for idx, text, wanted in items]
+    if json_mode:
+        reply_format = "Reply with a JSON array containing exactly one object {\"index\": <index>, \"text\": <translation>} per indexed input.\n"
+    else:
+        reply_format = "REPLY WITH EXACTLY ONE LINE PER INDEXED INPUT, format: index|||translation. NO EXTRA TEXT.\n"
+    return (
+        f"Some subtitle lines below are missing their {target_lang} translation.\n"
+        "Lines prefixed with an index and '|||' must be translated; lines prefixed with '[context]' are neighbouring lines "
+        "shown only for context - do NOT translate or output them.\n"
+        + reply_format +
+        "Keep each translation aligned with its own line; do not merge, move or reorder content between lines.\n\n"
+        + "\n".join(lines)
+    )
+    
+class ThreadEngine:
+    """
+    线程后端：在线程池里调用同步的 safe_call_generate，key 由共享的 KeyPool 分配。
+    """
+    def __init__(self, max_workers=MAX_WORKERS, pool=None):
+        self.concurrency = max_workers
+        self.pool = pool
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def generate(self, prompt, log=None, stop_flag=None, prompt_context=None):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(safe_call_generate, prompt, log=log, stop_flag=stop_flag, pool=self.pool, prompt_context=prompt_context)
+        return await loop.run_in_executor(self.executor, call)
+
+    async def aclose(self):
+        self.executor.shutdown(wait=False)
+
+class AsyncEngine:
+    """
+    asyncio 后端：使用 genai 的异步客户端，由 KeyPool 限制每个 key 的在途请求数和速率，
+    几十个批次同时在途也只占用一个线程。
+    """
+    def __init__(self, pool=None):
+        self.pool = pool or get_key_pool()
+        self.concurrency = max(1, self.pool.max_in_flight) * self.pool.active_count
+        self.clients = {}
+
+    def _client(self, api_key):
+        if api_key not in self.clients:
+            self.clients[api_key] = new_client(api_key).aio
+        return self.clients[api_key]
+
+    async def generate(self, prompt, log=None, stop_flag=None, prompt_context=None):
+        if log is None:
+            log = print
+
+        tokens = estimate_tokens(prompt) + (prompt_context.tokens if prompt_context else 0)
+        max_attempts = RETRY * len(self.pool.states)
+        attempts = 0
+        last_key = None
+
+        while True:
+            if stop_flag and stop_flag():
+                log("⚠️ API 请求被停止")
+                return None
+            with METRICS.timer("key_wait"):
+                state = await self.pool.acquire_async(tokens, stop_flag=stop_flag)
+            if state is None:
+                log("⚠️ API 请求被停止")
+                return None
+            if last_key is not None and state.key != last_key:
+                METRICS.inc("key_rotations")
+            last_key = state.key
+            try:
+                client = self._client(state.key)
+                config = await prompt_context.config_async(state.key, client) if prompt_context else None
+                with METRICS.timer("api"):
+                    resp = await client.models.generate_content(model=MODEL, contents=prompt, config=config)
+            except Exception as e:
+                self.pool.release(state, ok=False)
+                METRICS.inc("requests", "error")
+                attempts += 1
+                log(f"⚠️ API 请求失败 (尝试 {attempts}/{max_attempts})，错误: {e}")
+                if attempts >= max_attempts:
+                    raise Exception("API 请求多次失败，已放弃") from e
+                delay = handle_api_error(self.pool, state, e, log)
+                if delay:
+                    await asyncio.sleep(delay)
+                continue
+            self.pool.release(state)
+            METRICS.inc("requests", "ok")
+            record_usage(resp)
+            return resp.text
+
+    async def aclose(self):
+        for client in self.clients.values():
+            await client.aclose()
+
+def make_engine(backend=BACKEND, max_workers=MAX_WORKERS, pool=None):
+    if backend == "async":
+        return AsyncEngine(pool=pool)
+    if backend == "thread":
+        return ThreadEngine(max_workers=max_workers, pool=pool)
+    raise ValueError(f"未知的翻译后端: {backend}")
+
+async def translate_batch_with_index_async(texts, batch_start_index, engine, target_lang="Chinese", log=None, stop_flag=None,
+                                          json_mode=JSON_MODE, prompt_context=None):
     if log is None:
         log = print
-    prompt = f"Translate the following subtitle line into Chinese (single line):\n\n{text}\n\nReply only with the translation."
-    resp = safe_call_generate(prompt, log=log, stop_flag=stop_flag)
-    return resp.strip().replace("\n"," ") if resp else None
-    
-def has_language_text(text):
+    if stop_flag and stop_flag():
+        log("⚠️ 批量翻译被停止")
+        return [None] * len(texts)
+    prompt_context = prompt_context or make_prompt_context(target_lang, json_mode=json_mode, log=log)
+    METRICS.inc("calls", "batch")
+    with METRICS.timer("prompt"):
+        prompt = build_batch_prompt(texts, batch_start_index, json_mode=json_mode)
+    resp_text = await engine.generate(prompt, log=log, stop_flag=stop_flag, prompt_context=prompt_context)
+    return map_batch_response(resp_text, batch_start_index, len(texts), json_mode=json_mode)
+
+async def translate_line_single_async(text, engine, target_lang="Chinese", log=None, stop_flag=None, json_mode=JSON_MODE,
+                                      prompt_context=None):
+    if log is None:
+        log = print
+    if stop_flag and stop_flag():
+        log("⚠️ 单行翻译被停止")
+        return None
+    prompt_context = prompt_context or make_prompt_context(target_lang, json_mode=json_mode, log=log)
+    METRICS.inc("calls", "single")
+    with METRICS.timer("prompt"):
+        prompt = build_batch_prompt([text], 1, json_mode=json_mode)
+    resp = await engine.generate(prompt, log=log, stop_flag=stop_flag, prompt_context=prompt_context)
+    return map_single_response(resp, json_mode=json_mode)
+
+async def repair_missing_async(texts, batch_start_index, missing, engine, target_lang="Chinese", log=None, stop_flag=None,
+                               context=REPAIR_CONTEXT, json_mode=JSON_MODE, prompt_context=None):
     """
-    检查文本是否包含语言字符（非标点、非空格）。
-    使用 unicodedata 检查标点类别。
+    把一批中所有缺失的行合并成一次补译请求，每行附带前后 context 行原文作为上下文。
+    返回 {批内位置: 译文}，只包含补译成功的行。
     """
-    cleaned = ''.join(c for c in text if not unicodedata.category(c).startswith('P') and not c.isspace())
-    return bool(cleaned)
-    
-def convert_srt_to_ass(srt_file, target_lang_code, log=None, stop_flag=None):
+    if log is None:
+        log = print
+    if stop_flag and stop_flag():
+        return {}
+    wanted = set(missing)
+    positions = sorted({p for j in missing for p in range(j - context, j + context + 1) if 0 <= p < len(texts)})
+    items = [(batch_start_index + p, texts[p], p in wanted) for p in positions]
+    log(f"批 {batch_start_index} 缺失 {len(missing)} 行（索引 {', '.join(str(batch_start_index + j) for j in missing)}），合并补译")
+    prompt_context = prompt_context or make_prompt_context(target_lang, json_mode=json_mode, log=log)
+    METRICS.inc("calls", "repair")
+    with METRICS.timer("prompt"):
+        prompt = build_repair_prompt(items, target_lang, json_mode=json_mode)
+    resp_text = await engine.generate(prompt, log=log, stop_flag=stop_flag, prompt_context=prompt_context)
+    results = map_batch_response(resp_text, batch_start_index, len(texts), json_mode=json_mode)
+    return {j: results[j] for j in missing if results[j]}
+
+LANG_MAP = {"zh": "Chinese", "en": "English", "ko": "Korean", "ja": "Japanese"}
+
+def load_cues(srt_file, encoding=None):
+    """
+    流式读取并清洗字幕，返回紧凑的 (starts, ends, texts)：起止时间（毫秒）存放在 array 中，
+    只保留清洗后的文本。清洗按块进行，没有语言字符（即使有标点符号）的字幕整条删除。
+    """
+    starts, ends, texts = array("q"), array("q"), []
+    chunk = []
+    clean_time = 0.0
+
+    def drain():
+        nonlocal clean_time
+        clean_start = time.perf_counter()
+        cleaned = normalize_texts([c.text for c in chunk])
+        clean_time += time.perf_counter() - clean_start
+        for cue, text in zip(chunk, cleaned):
+            if text:
+                starts.append(cue.start)
+                ends.append(cue.end)
+                texts.append(text)
+        chunk.clear()
+
+    start = time.perf_counter()
+    for cue in iter_cues(srt_file, encoding=encoding):
+        chunk.append(cue)
+        if len(chunk) >= CLEAN_CHUNK_SIZE:
+            drain()
+    drain()
+    # 读取和清洗交替进行，解析耗时为总耗时减去清洗耗时
+    METRICS.observe("parse", time.perf_counter() - start - clean_time)
+    METRICS.observe("clean", clean_time)
+    return starts, ends, texts
+
+class OpenJobs:
+    """
+    限制同时打开输出文件和续传日志的任务数（每个任务占用 输出格式数 + 1 个文件句柄）。
+    超过 limit 时先让最久没有写出的任务落盘并关闭文件，它再次写出时按检查点重新打开。
+    """
+    def __init__(self, limit=MAX_OPEN_JOBS):
+        self.limit = limit
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def touch(self, job):
+        evicted = []
+        with self.lock:
+            self.jobs.pop(job, None)
+            self.jobs[job] = True
+            while len(self.jobs) > self.limit:
+                evicted.append(self.jobs.popitem(last=False)[0])
+        for old in evicted:
+            old.release()
+
+    def discard(self, job):
+        with self.lock:
+            self.jobs.pop(job, None)
+
+class FileJob:
+    """
+    单个 SRT 文件的翻译任务。
+    译文按 cue 乱序回填，flush 只按 cue 顺序把已完成的前缀同时交给每种输出格式的 writer；
+    每个完成的 cue 都记在旁边的续传日志里，输出文件每隔 CHECKPOINT_INTERVAL 秒落盘一次并记录各自的检查点，
+    中断后截回上一个检查点、用日志补齐，可以精确续传。
+    构造时只读取字幕和续传状态；输出文件和日志在第一次写出时才打开，文件完成后立即关闭，
+    open_jobs（OpenJobs）限制同时打开文件的任务数，选中再多的文件也不会耗尽文件句柄。
+    """
+    def __init__(self, srt_file, target_lang_code, log=print, ass_header=None, formats=None, dry_run=False, status=None,
+                 open_jobs=None):
+        self.srt_file = srt_file
+        self.status = status
+        self.open_jobs = open_jobs
+        self.target_lang = LANG_MAP.get(target_lang_code, "Chinese")
+        self.log = log
+        self.starts, self.ends, self.texts = load_cues(srt_file)
+        self.total = len(self.texts)
+        self.formats = list(dict.fromkeys(formats or FORMATS))
+        self.writers = make_writers(os.path.splitext(srt_file)[0], self.formats, ass_header or ASS_HEADER)
+        # 续传日志放在第一种输出旁边；默认只输出 ASS 时与之前的位置相同
+        self.output_file = self.writers[self.formats[0]].path
+        self.results = {}
+        self.lock = threading.Lock()
+        self.opened = False
+        self._load_state(dry_run)
+        self.checkpointed = self.next_start
+        self.last_checkpoint = time.monotonic()
+
+    def _load_state(self, dry_run=False):
+        """
+        确定续传位置和各输出打开时的截断位置（offsets，为 None 表示新建），不打开任何文件；
+        dry_run 为 True 时只读取续传状态，不修改任何文件。
+        """
+        meta = {
+            "source": file_sha256(self.srt_file),
+            "clean": CLEAN_VERSION,
+            "prompt": PROMPT_VERSION,
+            "lang": self.target_lang,
+            "model": MODEL,
+            "formats": self.formats,
+        }
+        self.journal = ResumeJournal(self.output_file + ".journal", meta, total=self.total)
+        # 为 False 时日志还需要重写（元信息 + 起始检查点），为 True 时直接追加
+        self.journal_started = False
+        self.offsets = None
+        outputs_exist = all(os.path.exists(w.path) for w in self.writers.values())
+        state = self.journal.load() if outputs_exist else None
+
+        if state:
+            # 按日志续传：打开时截掉检查点之后可能残留的内容，已完成但未写出的 cue 直接回填
+            results, self.next_start, self.offsets = state
+            self.results = {i: t for i, t in results.items() if i >= self.next_start}
+            self.journal_started = True
+            return
+
+        if self.formats == ["ass"] and outputs_exist and not self.journal.exists:
+            # 旧版本生成的 ASS 没有日志，退回按 Dialogue 行数续传
+            self.next_start = parse_existing_ass(self.output_file, truncate=not dry_run)
+        else:
+            if self.journal.exists:
+                self.log(f"⚠️ {os.path.basename(self.srt_file)} 的源文件、目标语言、输出格式或翻译规则已变化，重新翻译")
+            self.next_start = 0
+        if self.next_start:
+            self.offsets = {fmt: os.path.getsize(writer.path) for fmt, writer in self.writers.items()}
+
+    def _open_files(self):
+        if self.open_jobs:
+            self.open_jobs.touch(self)
+        if self.opened:
+            return
+        for fmt, writer in self.writers.items():
+            writer.open(self.offsets[fmt] if self.offsets else None)
+        if self.journal_started:
+            self.journal.open()
+        else:
+            self.offsets = self.write_checkpoint()
+            self.journal.start(self.next_start, self.offsets)
+            self.journal_started = True
+        self.opened = True
+
+    def _close_files(self):
+        if self.open_jobs:
+            self.open_jobs.discard(self)
+        if not self.opened:
+            return
+        if self.next_start != self.checkpointed:
+            self.checkpoint()
+        for writer in self.writers.values():
+            writer.close()
+        self.journal.close()
+        self.opened = False
+
+    def text(self, idx):
+        return self.texts[idx]
+
+    @property
+    def done(self):
+        return self.next_start >= self.total
+
+    def resolve(self, idx, trans):
+        self.results[idx] = trans
+        self.journal.record(idx, trans)
+
+    def write_checkpoint(self):
+        return {fmt: writer.checkpoint() for fmt, writer in self.writers.items()}
+
+    def checkpoint(self):
+        with METRICS.timer("checkpoint"):
+            self.offsets = self.write_checkpoint()
+        if self.done:
+            self.journal.compact(self.next_start, self.offsets)
+        else:
+            self.journal.checkpoint(self.next_start, self.offsets)
+        self.checkpointed = self.next_start
+        self.last_checkpoint = time.monotonic()
+
+    def release(self):
+        """落盘并关闭文件，之后再写出时按检查点重新打开。"""
+        with self.lock:
+            self._close_files()
+
+    def close(self):
+        with self.lock:
+            if self.results and not self.opened:
+                # 已完成但还没写出的 cue 只在内存里，关闭前写进日志，续传时可以直接回填
+                self._open_files()
+            self._close_files()
+
+    def flush(self):
+        with self.lock:
+            first = self.next_start
+            if self.next_start not in self.results:
+                return
+            self._open_files()
+            with METRICS.timer("write"):
+                while self.next_start in self.results:
+                    trans = self.results.pop(self.next_start)
+                    idx = self.next_start
+                    self.next_start += 1
+                    if trans:
+                        for writer in self.writers.values():
+                            writer.write(self.starts[idx], self.ends[idx], self.texts[idx], trans)
+            if self.done or time.monotonic() - self.last_checkpoint >= CHECKPOINT_INTERVAL:
+                self.checkpoint()
+            self.log(f"已写入第 {first + 1}-{self.next_start} 行到 {self.output_file}")
+            if self.done:
+                self._close_files()
+                self.log(f"完成文件: {os.path.basename(self.srt_file)}")
+                if self.status:
+                    self.status(self.srt_file, "done")
+
+def convert_srt_to_ass(srt_file, target_lang_code, log=None, stop_flag=None, engine=None, **kwargs):
     if log is None:
         log = print
     if stop_flag and stop_flag():
         log(f"⚠️ 文件 {srt_file} 处理被停止")
         return
-    lang_map = {"zh": "Chinese", "en": "English", "ko": "Korean", "ja": "Japanese"}
-    target_lang = lang_map.get(target_lang_code, "Chinese")
-    log(f"线程 {threading.current_thread().name} 开始处理文件: {srt_file} -> 目标语言: {target_lang}")
+    # 单文件也走同一套调度：批次并发翻译、乱序完成，由 FileJob 按 cue 顺序写出已完成的前缀
+    return translate_files([srt_file], target_lang_code, log=log, stop_flag=stop_flag, engine=engine, **kwargs)
 
-    subs = pysrt.open(srt_file, encoding="utf-8")
-    
-    # 格式化处理
-    for sub in subs:
-        # 删除听障文本 
-        sub.text = re.sub(r'\[.*?\]', '', sub.text)
-        # 删除:前听障文本（人名/机构名字符串）
-        sub.text = re.sub(r'^[A-Za-z][A-Za-z\s]*:', '', sub.text)
-                
-        # 删除<font <i>文本
-        sub.text = re.sub(r'<font[^>]*>', '', sub.text).replace('</font>', '')
-        sub.text = re.sub(r'<i>(?:(?![a-zA-Z0-9]).)*?</i>', '', sub.text)
-        
-        # 删除换行符，将多行文本转换为单行（替换为单个空格）
-        sub.text = re.sub(r'\n', ' ', sub.text)
-        
-        # 处理破折号：将 "--" 转换为 "..."
-        sub.text = re.sub(r'--', '...', sub.text)
-        
-        # 确保 "-" 后有且仅有一个空格：
-        sub.text = re.sub(r'-\s+', '- ', sub.text)        
-        sub.text = re.sub(r' -\s+', ' - ', sub.text)
-        
-        # 将所有双空格（或多空格）换成单空格
-        sub.text = re.sub(r'\s+', ' ', sub.text)
-        
-        # 去除首尾空格
-        sub.text = sub.text.strip()
-
-    # 去除没有文本字幕的空行：如果没有语言字符，即使有标点符号，也删除该行字幕
-    subs[:] = [sub for sub in subs if sub.text and has_language_text(sub.text)]
+def plan_units(jobs, dedup=True):
+    """
+    把所有文件中待翻译的行整理成翻译单元。
+    dedup 为 True 时，清洗后文本相同（且目标语言相同）的行合并成一个单元，只在首次出现的位置发送，
+    切批时仍按原文顺序截取，保留上下文。返回 (segments, units)：
+    segments 是 (job, [unit_key, ...]) 列表，按文件列出首次出现在该文件的单元；
+    units 把 unit_key 映射到引用它的 [(job, idx), ...]。
+    """
+    units = {}
+    segments = []
+    for job in jobs:
+        fresh = []
+        for idx in range(job.next_start, job.total):
+            if idx in job.results:
+                # 续传日志里已完成、只是还没写出的 cue
+                continue
+            text = job.text(idx)
+            key = (job.target_lang, text) if dedup else (job.target_lang, text, job.srt_file, idx)
+            refs = units.get(key)
+            if refs is None:
+                refs = units[key] = []
+                fresh.append(key)
+            refs.append((job, idx))
+        if fresh:
+            segments.append((job, fresh))
+    return segments, units
 
-    
-    total = len(subs)
-    ass_file = os.path.splitext(srt_file)[0] + ".Dex7er.EN.CN.ass"
-    done_count = parse_existing_ass(ass_file)
+def dedup_savings(jobs, segments, units, batch_size=BATCH_SIZE, prompt_tokens=0):
+    """估算去重节省的行数、请求数和输入 token 数（请求数按固定 batch_size 估算，每个请求另计 prompt_tokens 个固定提示词 token）。"""
+    lines = sum(len(refs) for refs in units.values()) - len(units)
+    plain_batches = sum(-(-(job.total - job.next_start) // batch_size) for job in jobs)
+    requests = plain_batches - sum(-(-len(keys) // batch_size) for _, keys in segments)
+    tokens = sum(estimate_tokens(key[1]) * (len(refs) - 1) for key, refs in units.items())
+    tokens += requests * prompt_tokens
+    return lines, requests, tokens
 
-    if done_count == 0:
-        with open(ass_file, "w", encoding="utf-8") as f:
-            f.write(ASS_HEADER)
+class AdaptiveBatcher:
+    """
+    按需切批：每批不超过目标行数，同时原文估算 token 数不超过 token_budget。
+    每批翻译完成后用 feedback 报告缺失索引数，按平滑后的缺失比例调整目标行数：偏高时缩小，偏低时逐步放大。
+    缩小后若缺失比例没有下降（例如随机丢行，与批大小无关），说明缩小只会增加请求数，
+    于是恢复原大小并以它为下限，在减少请求次数和避免逐行补译之间自动取平衡。
+    """
+    def __init__(self, segments, target_size=BATCH_SIZE, token_budget=BATCH_TOKEN_BUDGET,
+                 min_size=MIN_BATCH_SIZE, max_size=MAX_BATCH_SIZE, log=None):
+        self.segments = deque((job, deque(keys)) for job, keys in segments)
+        self.target_size = target_size
+        self.token_budget = token_budget
+        self.min_size = min_size
+        self.max_size = max_size
+        self.log = log or print
+        self.miss_rate = 0.0
+        # 按当前目标大小切出的批次的 [批数, 行数, 缺失数]，目标大小变化时清零
+        self.window = [0, 0, 0]
+        # 最近一次缩小前的 (批大小, 该大小下的缺失比例)，确认缩小有效后清空
+        self.shrunk_from = None
 
-    for start in range(done_count, total, BATCH_SIZE):
-        if stop_flag and stop_flag():
-            log(f"⚠️ 文件 {srt_file} 批处理被停止")
-            break
-        batch_subs = subs[start:start + BATCH_SIZE]
-        texts = [s.text.strip().replace("\n"," ") for s in batch_subs]
-        translations = translate_batch_with_index(texts, start, target_lang=target_lang, log=log, stop_flag=stop_flag)
-        for j, trans in enumerate(translations):
-            if not trans:
-                translations[j] = translate_line_single(texts[j], log=log, stop_flag=stop_flag)
-        with open(ass_file, "a", encoding="utf-8") as f:
-            for sub, trans in zip(batch_subs, translations):
-                if not trans:
-                    continue
-                start_time = srt_time_to_ass(sub.start)
-                end_time = srt_time_to_ass(sub.end)
-                orig = sub.text.strip().replace("\n"," ")
-                line = f"Dialogue: 0,{start_time},{end_time},Default,,0,0,0,,{orig}\\N{{rEng}}{trans}"
-                f.write(line + "\n")
-        log(f"线程 {threading.current_thread().name} - 已写入批 {start//BATCH_SIZE + 1} 到 {ass_file}")
-
-    if not (stop_flag and stop_flag()):
-        log(f"线程 {threading.current_thread().name} - 完成文件: {os.path.basename(srt_file)}")
-
-def translate_files(srt_files, target_lang_code, log=None, stop_flag=None):
+    def next_batch(self):
+        while self.segments and not self.segments[0][1]:
+            self.segments.popleft()
+        if not self.segments:
+            return None
+        job, keys = self.segments[0]
+        batch = []
+        tokens = 0
+        while keys and len(batch) < self.target_size:
+            cost = estimate_tokens(keys[0][1])
+            if batch and tokens + cost > self.token_budget:
+                break
+            batch.append(keys.popleft())
+            tokens += cost
+        return job, batch
+
+    def _resize(self, size):
+        self.target_size = size
+        self.window = [0, 0, 0]
+
+    def feedback(self, size, missing):
+        if size <= 0:
+            return
+        self.miss_rate += MISSING_RATE_SMOOTHING * (missing / size - self.miss_rate)
+        old = self.target_size
+        window = self.window
+        # 调整前已发出的更大批次不计入当前大小的统计
+        if size <= self.target_size:
+            window[0] += 1
+            window[1] += size
+            window[2] += missing
+        if self.shrunk_from and window[0] >= SHRINK_CHECK_BATCHES:
+            prev_size, prev_rate = self.shrunk_from
+            self.shrunk_from = None
+            rate = window[2] / window[1]
+            if rate > prev_rate / 2:
+                self.min_size = prev_size
+                self._resize(prev_size)
+                self.miss_rate = rate
+                self.log(f"缩小批次后缺失比例没有下降（{rate:.0%}），批大小恢复为 {prev_size}，不再缩小")
+                return
+        if self.miss_rate > MISSING_RATE_SHRINK and missing > 1:
+            # 当前大小至少观察两批再缩小，缩小前的缺失比例才有参考价值
+            if not self.shrunk_from and self.target_size > self.min_size and window[0] >= 2:
+                self.shrunk_from = (self.target_size, window[2] / window[1])
+                self._resize(max(self.min_size, int(self.target_size * 0.7)))
+        elif self.miss_rate < MISSING_RATE_SHRINK / 2 and size >= self.target_size and not self.shrunk_from:
+            self._resize(min(self.max_size, self.target_size + max(1, self.target_size // 5)))
+        if self.target_size != old:
+            self.log(f"批大小调整为 {self.target_size}（上一批缺失 {missing}/{size}，平均缺失比例 {self.miss_rate:.0%}）")
+
+async def translate_unit_batch_async(job, keys, units, engine, log=None, stop_flag=None, memory=None, batcher=None,
+                                     json_mode=JSON_MODE, prompt_context=None):
+    if log is None:
+        log = print
+    if stop_flag and stop_flag():
+        return None
+    texts = [key[1] for key in keys]
+    start = units[keys[0]][0][1]
+
+    # 先查翻译记忆，只把未命中的行发给 Gemini
+    cached = memory.get_many(texts, job.target_lang, MODEL) if memory else {}
+    translations = [cached.get(t) for t in texts]
+    miss_pos = [i for i, trans in enumerate(translations) if not trans]
+    if memory:
+        METRICS.inc("memory_lookups", "hit", len(texts) - len(miss_pos))
+        METRICS.inc("memory_lookups", "miss", len(miss_pos))
+
+    if miss_pos:
+        miss_texts = [texts[i] for i in miss_pos]
+        results = await translate_batch_with_index_async(miss_texts, start, engine, target_lang=job.target_lang, log=log, stop_flag=stop_flag,
+                                                         json_mode=json_mode, prompt_context=prompt_context)
+        if batcher and not (stop_flag and stop_flag()):
+            batcher.feedback(len(results), sum(1 for trans in results if not trans))
+        missing = [j for j, trans in enumerate(results) if not trans]
+        if missing:
+            repaired = await repair_missing_async(miss_texts, start, missing, engine, target_lang=job.target_lang, log=log, stop_flag=stop_flag,
+                                                  json_mode=json_mode, prompt_context=prompt_context)
+            for j, trans in repaired.items():
+                results[j] = trans
+        # 补译后仍缺失的行才逐行翻译
+        for j in missing:
+            if not results[j]:
+                results[j] = await translate_line_single_async(miss_texts[j], engine, target_lang=job.target_lang, log=log, stop_flag=stop_flag,
+                                                               json_mode=json_mode, prompt_context=prompt_context)
+        for i, trans in zip(miss_pos, results):
+            translations[i] = trans
+        if memory:
+            memory.put_many(zip(miss_texts, results), job.target_lang, MODEL)
+
+    # 被停止的批次不回填，避免在 ASS 中留下未翻译的空洞
+    if stop_flag and stop_flag():
+        return None
+
+    # 把译文分发给引用同一单元的所有行，再让涉及的文件写出已完成的前缀
+    touched = {}
+    for key, trans in zip(keys, translations):
+        for ref_job, idx in units[key]:
+            ref_job.resolve(idx, trans)
+            touched[id(ref_job)] = ref_job
+    for ref_job in touched.values():
+        ref_job.flush()
+    return translations
+
+async def run_jobs_async(jobs, engine, concurrency=None, log=None, stop_flag=None, memory=None, dedup=True, json_mode=JSON_MODE,
+                         prompt_context=None):
+    """
+    跨文件共享的批次调度：所有文件的批次放进同一个队列，由 concurrency 个协程取用，
+    实际的 API 并发由 engine 控制（线程池大小或 KeyPool 的每 key 在途上限）。
+    所有批次共用 prompt_context 中的固定提示词（为空时按第一个文件的目标语言创建，不使用上下文缓存）。
+    """
+    if log is None:
+        log = print
+    if concurrency is None:
+        concurrency = engine.concurrency
+    if prompt_context is None and jobs:
+        prompt_context = make_prompt_context(jobs[0].target_lang, json_mode=json_mode, log=log)
+    segments, units = plan_units(jobs, dedup=dedup)
+    if dedup:
+        lines, requests, tokens = dedup_savings(jobs, segments, units, prompt_tokens=prompt_context.tokens if prompt_context else 0)
+        METRICS.inc("dedup_saved_lines", amount=lines)
+        if lines:
+            log(f"去重合并 {lines} 行，节省约 {requests} 个请求、{tokens} 个输入 token")
+    # 按文件顺序切批，靠前的文件先完成；空闲的协程会自动接手后续文件的批次
+    batcher = AdaptiveBatcher(segments, log=log)
+    log(f"共 {len(jobs)} 个文件，{len(units)} 个待翻译单元，并发数 {concurrency}")
+
+    async def worker():
+        while True:
+            if stop_flag and stop_flag():
+                return
+            batch = batcher.next_batch()
+            if batch is None:
+                return
+            job, keys = batch
+            await translate_unit_batch_async(job, keys, units, engine, log=log, stop_flag=stop_flag, memory=memory, batcher=batcher,
+                                             json_mode=json_mode, prompt_context=prompt_context)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+def translate_files(srt_files, target_lang_code, log=None, stop_flag=None, max_workers=MAX_WORKERS, backend=BACKEND, engine=None,
+                    concurrency=None, use_memory=True, dedup=True, json_mode=JSON_MODE, ass_header=None,
+                    formats=None, api_keys=None, status=None, glossary=None, show_context=None, context_cache=CONTEXT_CACHE):
+    """
+    翻译一组 SRT 文件。backend 选择 thread（线程池，max_workers 个并发）或
+    async（异步客户端，每个 key PER_KEY_CONCURRENCY 个并发）；也可以直接传入自定义 engine。
+    两种后端共用进程级的 KeyPool，整体吞吐按所有 key 的配额之和调度。
+    use_memory 为 True 时先查翻译记忆，只翻译未命中的行；dedup 为 True 时相同文本只翻译一次；
+    json_mode 为 True 时要求 Gemini 按 JSON schema 返回结构化结果；ass_header 可替换默认的 ASS_HEADER 样式头；
+    formats 为输出格式列表（默认 FORMATS），同一轮翻译同时写出所有格式；
+    api_keys 为使用的 API key 列表，为空时读取 KEYS_FILE；
+    status(srt_file, state) 在文件开始翻译（translating）、完成（done）或被停止（stopped）时调用。
+    glossary（{原文: 译名}，为空时读取 GLOSSARY_FILE）和 show_context（剧情背景说明）加入固定提示词；
+    context_cache 为 True 时固定提示词在每个 key 上注册为上下文缓存，运行结束后删除。
+    返回本次运行的统计（各阶段耗时、请求和重试次数、token 数、缓存命中率，见 metrics.Metrics.summary）。
+    """
+    if log is None:
+        log = print
     if not srt_files:
-        if log:
-            log("没有传入 SRT 文件")
-        return
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS, initializer=init_thread_local) as executor:
-        futures = []
+        log("没有传入 SRT 文件")
+        return None
+    started = METRICS.snapshot()
+    # 先确认有可用的 key，再开始创建输出文件
+    pool = get_key_pool(api_keys) if engine is None else None
+
+    jobs = []
+    open_jobs = OpenJobs(MAX_OPEN_JOBS)
+    try:
         for srt_file in srt_files:
             if stop_flag and stop_flag():
-                log("⚠️ 翻译任务被停止")
                 break
-            futures.append(executor.submit(convert_srt_to_ass, srt_file, target_lang_code, log=log, stop_flag=stop_flag))
-        for f in futures:
-            if stop_flag and stop_flag():
-                break
-            f.result()
-    if log and not (stop_flag and stop_flag()):
+            job = FileJob(srt_file, target_lang_code, log=log, ass_header=ass_header, formats=formats, status=status,
+                          open_jobs=open_jobs)
+            # 先写出续传日志里已完成的前缀
+            job.flush()
+            if job.done:
+                job.close()
+                log(f"已完成，跳过文件: {os.path.basename(srt_file)}")
+                if status:
+                    status(srt_file, "done")
+                continue
+            log(f"开始处理文件: {srt_file} -> 目标语言: {job.target_lang}")
+            if status:
+                status(srt_file, "translating")
+            jobs.append(job)
+    except BaseException:
+        # 后面的文件读取失败时，已创建的任务先落盘并关闭
+        for job in jobs:
+            job.close()
+        raise
+    if stop_flag and stop_flag():
+        for job in jobs:
+            job.close()
+            if status:
+                status(job.srt_file, "stopped")
+        log("⚠️ 翻译任务被停止")
+        return METRICS.summary(since=started)
+
+    memory = get_translation_memory() if use_memory else None
+    if memory:
+        hits, misses = memory.hits, memory.misses
+
+    own_engine = engine is None
+    if own_engine:
+        engine = make_engine(backend, max_workers=max_workers, pool=pool)
+    if glossary is None:
+        glossary = load_glossary()
+    prompt_context = make_prompt_context(LANG_MAP.get(target_lang_code, "Chinese"), json_mode=json_mode, glossary=glossary,
+                                         show_context=show_context, use_cache=context_cache, log=log)
+
+    async def export_loop():
+        # 长时间运行时定期刷新 Prometheus 文件，方便在任务进行中观察
+        while True:
+            await asyncio.sleep(metrics.EXPORT_INTERVAL)
+            METRICS.export()
+
+    async def run():
+        exporter = asyncio.create_task(export_loop()) if metrics.PROMETHEUS_FILE else None
+        try:
+            await run_jobs_async(jobs, engine, concurrency=concurrency, log=log, stop_flag=stop_flag, memory=memory, dedup=dedup,
+                                 json_mode=json_mode, prompt_context=prompt_context)
+        finally:
+            if exporter:
+                exporter.cancel()
+            for job in jobs:
+                job.close()
+                if status and not job.done:
+                    status(job.srt_file, "stopped")
+            if own_engine:
+                await engine.aclose()
+
+    try:
+        asyncio.run(run())
+    finally:
+        prompt_context.close(get_client)
+    if memory:
+        log(f"翻译记忆命中 {memory.hits - hits} 行，未命中 {memory.misses - misses} 行")
+    if stop_flag and stop_flag():
+        log("⚠️ 翻译任务被停止")
+    else:
         log("所有文件翻译完成")
+    summary = METRICS.summary(since=started)
+    log(format_summary(summary))
+    METRICS.export()
+    return summary
+
+def plan_translation(srt_files, target_lang_code, log=None, use_memory=True, dedup=True, formats=None, json_mode=JSON_MODE,
+                     api_keys=None, glossary=None, show_context=None, context_cache=CONTEXT_CACHE):
+    """
+    只统计、不翻译（dry-run）：不调用 API，也不创建或修改任何文件。
+    按续传状态、去重和翻译记忆得到实际需要发送的行，再用 AdaptiveBatcher 按运行时的规则切批（假设每批完整返回），
+    用真实的提示词估算输入 token（固定提示词满足 CACHE_MIN_TOKENS 且启用 context_cache 时计为缓存 token），
+    按 OUTPUT_TOKEN_RATIO 估算输出 token，
+    并按 key 数和 KEY_RPM/KEY_TPM/KEY_RPD 估算耗时和需要的天数（不含补译请求和思考 token），返回统计字典。
+    api_keys 只用于计算 key 数，为空时读取 KEYS_FILE，读取失败按 1 个 key 估算。
+    """
+    if log is None:
+        log = print
+    jobs = [FileJob(f, target_lang_code, log=log, formats=formats, dry_run=True) for f in srt_files]
+    pending = [job for job in jobs if not job.done]
+    if glossary is None:
+        glossary = load_glossary()
+    system_tokens = estimate_tokens(build_system_instruction(LANG_MAP.get(target_lang_code, "Chinese"), json_mode=json_mode,
+                                                             glossary=glossary, show_context=show_context))
+    cacheable = context_cache and system_tokens >= CACHE_MIN_TOKENS
+    segments, units = plan_units(pending, dedup=dedup)
+
+    # 只读查询翻译记忆：文件不存在时不创建，已打开的共享实例直接复用
+    memory = own_memory = None
+    if use_memory and TM_FILE:
+        memory = _memory
+        if memory is None and os.path.exists(TM_FILE):
+            memory = own_memory = TranslationMemory(TM_FILE, read_only=True)
+    cached = set()
+    try:
+        if memory:
+            for lang in {job.target_lang for job in pending}:
+                texts = [key[1] for key in units if key[0] == lang]
+                cached.update((lang, t) for t in memory.get_many(texts, lang, MODEL, touch=False))
+    finally:
+        if own_memory:
+            own_memory.close()
+
+    # 与 translate_unit_batch_async 相同：按原文顺序切批，批内命中翻译记忆的行不发送，整批命中则不发请求
+    batcher = AdaptiveBatcher(segments, log=lambda msg: None)
+    lines, sent, requests = {}, {}, {}
+    input_tokens = output_tokens = 0
+    for refs in units.values():
+        for job, _ in refs:
+            lines[job] = lines.get(job, 0) + 1
+    while True:
+        batch = batcher.next_batch()
+        if batch is None:
+            break
+        job, keys = batch
+        texts = [key[1] for key in keys if key[:2] not in cached]
+        if not texts:
+            continue
+        start = units[keys[0]][0][1]
+        sent[job] = sent.get(job, 0) + len(texts)
+        requests[job] = requests.get(job, 0) + 1
+        input_tokens += estimate_tokens(build_batch_prompt(texts, start, json_mode=json_mode)) + system_tokens
+        output_tokens += int(sum(estimate_tokens(f"{start + i}|||{t}") for i, t in enumerate(texts)) * OUTPUT_TOKEN_RATIO)
+        batcher.feedback(len(texts), 0)
+    for job in jobs:
+        if job.done:
+            log(f"{os.path.basename(job.srt_file)}: 已完成，跳过")
+        else:
+            log(f"{os.path.basename(job.srt_file)}: 共 {job.total} 行，待翻译 {lines.get(job, 0)} 行，"
+                f"需发送 {sent.get(job, 0)} 行 / {requests.get(job, 0)} 个请求")
+
+    if api_keys is None:
+        try:
+            api_keys = load_api_keys()
+        except Exception as e:
+            log(f"⚠️ {e}，按 1 个 API key 估算")
+            api_keys = ["?"]
+    keys = max(1, len(set(k.strip() for k in api_keys if k and k.strip())))
+    total_requests = sum(requests.values())
+    # 令牌桶按估算的输入 token 限速；耗时取 RPM 和 TPM 两个限制中较慢的一个
+    minutes = None
+    if KEY_RPM or KEY_TPM:
+        minutes = max(total_requests / (keys * KEY_RPM) if KEY_RPM else 0,
+                      input_tokens / (keys * KEY_TPM) if KEY_TPM else 0)
+    plan = {
+        "files": len(jobs),
+        "done_files": len(jobs) - len(pending),
+        "lines": sum(len(refs) for refs in units.values()),
+        "units": len(units),
+        "memory_hits": sum(1 for key in units if key[:2] in cached),
+        "requests": total_requests,
+        "input_tokens": input_tokens,
+        "prompt_overhead_tokens": total_requests * system_tokens,
+        "cached_tokens": total_requests * system_tokens if cacheable else 0,
+        "output_tokens": output_tokens,
+        "keys": keys,
+        "minutes": round(minutes, 1) if minutes is not None else None,
+        "days": -(-total_requests // (keys * KEY_RPD)) if KEY_RPD else None,
+        "formats": list(dict.fromkeys(formats or FORMATS)),
+    }
+    plan["sent"] = plan["units"] - plan["memory_hits"]
+    log(f"共 {plan['files']} 个文件（已完成 {plan['done_files']} 个），待翻译 {plan['lines']} 行，"
+        f"去重后 {plan['units']} 行，翻译记忆命中 {plan['memory_hits']} 行，"
+        f"预计发送 {plan['sent']} 行 / {plan['requests']} 个请求")
+    log(f"预计输入 {plan['input_tokens']} token（其中固定提示词约 {plan['prompt_overhead_tokens']}"
+        f"{'，由上下文缓存提供' if cacheable else ''}），输出约 {plan['output_tokens']} token")
+    if plan["minutes"] is not None:
+        limits = f"{keys} 个 key，每个 {KEY_RPM or '不限'} RPM / {KEY_TPM or '不限'} TPM"
+        estimate = f"按 {limits}，预计至少需要 {plan['minutes']} 分钟"
+    else:
+        estimate = f"{keys} 个 key，未设置每个 key 的 RPM/TPM 限制，不估算耗时"
+    if plan["days"] is not None:
+        estimate += f"；按每个 key 每天 {KEY_RPD} 个请求，需要 {plan['days']} 天"
+    log(estimate)
+    return plan
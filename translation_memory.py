@@ -0,0 +1,99 @@
+import os
+import time
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+# SQLite 单条语句的参数个数有上限，批量查询时分块
+_CHUNK = 500
+
+
+class TranslationMemory:
+    """
+    磁盘上的翻译记忆（SQLite），以 (原文, 目标语言, 模型) 为键。
+    条目超过 max_entries 时按最近使用时间淘汰最旧的一部分（LRU）。
+    read_only 为 True 时以只读方式打开已有的文件（用于 dry-run），不建表、不修改日志模式，只能用 get_many(touch=False) 查询。
+    """
+    def __init__(self, path, max_entries=200000, read_only=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if read_only:
+            uri = f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+            if not os.path.exists(path + "-wal"):
+                # 没有 -wal 文件说明没有其他连接在写；WAL 模式的库只读打开时仍会创建 -wal/-shm，immutable 可以避免
+                uri += "&immutable=1"
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self.count = self.conn.execute("SELECT COUNT(*) FROM tm").fetchone()[0]
+            return
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS tm ("
+                " source TEXT NOT NULL, lang TEXT NOT NULL, model TEXT NOT NULL,"
+                " target TEXT NOT NULL, used REAL NOT NULL,"
+                " PRIMARY KEY (source, lang, model))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS tm_used ON tm (used)")
+        self.count = self.conn.execute("SELECT COUNT(*) FROM tm").fetchone()[0]
+
+    def get_many(self, texts, lang, model, touch=True):
+        """
+        返回 {原文: 译文}，只包含命中的条目，并刷新它们的最近使用时间。
+        touch 为 False 时只查询（用于 dry-run），不更新使用时间和命中统计。
+        """
+        unique = list(dict.fromkeys(texts))
+        found = {}
+        with self.lock:
+            for i in range(0, len(unique), _CHUNK):
+                chunk = unique[i:i + _CHUNK]
+                marks = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT source, target FROM tm WHERE lang = ? AND model = ? AND source IN ({marks})",
+                    [lang, model, *chunk],
+                ).fetchall()
+                found.update(rows)
+            if not touch:
+                return found
+            if found:
+                now = time.time()
+                with self.conn:
+                    self.conn.executemany(
+                        "UPDATE tm SET used = ? WHERE source = ? AND lang = ? AND model = ?",
+                        [(now, source, lang, model) for source in found],
+                    )
+            self.hits += sum(1 for t in texts if t in found)
+            self.misses += sum(1 for t in texts if t not in found)
+        return found
+
+    def put_many(self, pairs, lang, model):
+        """写入 (原文, 译文) 列表，空译文不记录。"""
+        rows = [(source, lang, model, target, time.time()) for source, target in pairs if source and target]
+        if not rows:
+            return
+        with self.lock:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO tm VALUES (?, ?, ?, ?, ?)", rows)
+            self.count += len(rows)
+            if self.count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        # 一次多淘汰 10%，避免每次写入都触发淘汰
+        self.count = self.conn.execute("SELECT COUNT(*) FROM tm").fetchone()[0]
+        excess = self.count - int(self.max_entries * 0.9)
+        if excess <= 0:
+            return
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM tm WHERE rowid IN (SELECT rowid FROM tm ORDER BY used LIMIT ?)",
+                (excess,),
+            )
+        self.count -= excess
+
+    def close(self):
+        with self.lock:
+            self.conn.close()